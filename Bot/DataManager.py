@@ -1,44 +1,269 @@
+import re
+from sys import intern
+
+# Matches the decimal numbers which survive a str -> int -> str round trip
+_DECIMAL_PATTERN = re.compile(r"(?:0|[1-9][0-9]*)\Z")
+
+
+class ClientRecord:
+    """!
+    @brief Data of a single online client.
+
+    The frequently used numeric teamspeak fields are converted to integers once and kept in their own slots,
+    all other teamspeak fields are kept in the fields dictionary with interned keys. Decimal values in that
+    dictionary are stored as integers as well, which roughly halves their size.
+    get and set convert the integers from and to strings, so a record behaves like a dictionary of strings.
+    The bot itself reads the slots directly, e.g through DataManager.get_client_cid_by_clid.
+    """
+
+    # teamspeak key -> slot holding its integer value
+    TYPED_FIELDS = {
+        "clid": "clid",
+        "cid": "cid",
+        "client_database_id": "cldbid",
+        "client_type": "client_type"
+    }
+
+    __slots__ = ("clid", "cid", "cldbid", "client_type", "fields", "custom_data", "servergroups", "access_level",
+                 "stored_access_level")
+
+    def __init__(self, client_data, custom_data=None):
+        """!
+        @brief Creates a record from the teamspeak data of a client.
+
+        @param client_data Mapping of teamspeak keys to string values, e.g a clientinfo answer
+        @param custom_data Dictionary of custom client values
+        """
+        self.clid = None
+        self.cid = None
+        self.cldbid = None
+        self.client_type = None
+        self.fields = {}
+        self.custom_data = custom_data if custom_data is not None else {}
+        self.servergroups = {}
+        # cached result of get_access_level_by_clid, None when it has to be recomputed
+        self.access_level = None
+        # access level last written to the database
+        self.stored_access_level = None
+        for key in client_data:
+            self.set(key, client_data[key])
+
+    def get(self, key, default_value=None):
+        """!
+        @brief Returns the string value of a teamspeak field.
+
+        @param key The teamspeak key
+        @param default_value The value to return when the field is not set
+        @return The value or default_value
+        """
+        slot = self.TYPED_FIELDS.get(key)
+        value = self.fields.get(key) if slot is None else getattr(self, slot)
+        if value is None:
+            return default_value
+        if type(value) is int:
+            return str(value)
+        return value
+
+    def set(self, key, value):
+        """!
+        @brief Sets a teamspeak field.
+
+        @param key The teamspeak key
+        @param value The string value
+        @return None
+        """
+        slot = self.TYPED_FIELDS.get(key)
+        if slot is not None:
+            setattr(self, slot, None if value is None else int(value))
+        elif type(value) is str and _DECIMAL_PATTERN.match(value):
+            self.fields[intern(key)] = int(value)
+        else:
+            self.fields[intern(key)] = value
+
+
 class DataManager:
-    def __init__(self, mysql_manager=None):
+    # teamspeak keys which are part of a secondary index
+    _INDEXED_KEYS = frozenset(("client_database_id", "client_unique_identifier", "client_type", "cid"))
+
+    def __init__(self, storage_manager=None):
         self._clientList = {}
         self._channelList = {}
         self._accessLevels = {}
         self._defaultAccessLevel = 0
-        self._mysqlManager = mysql_manager
+        self._storageManager = storage_manager
         self._settings = {}
 
+        # secondary indexes, kept up to date by every method which changes the indexed values
+        self._normalClients = {}  # clid -> None, clients which are no server query clients, in join order
+        self._clidsByCldbid = {}  # cldbid -> set of clids
+        self._clidByUid = {}  # client_unique_identifier -> clid
+        self._clidsByChannel = {}  # cid -> set of clids, only contains normal clients
+        self._clidsByServergroup = {}  # sgid -> set of clids
+
+        # cid -> whether the channel was occupied before the current change, see _report_occupancy_changes
+        self._occupancyChanges = {}
+        self._channelOccupancyCallback = None
+
+    @staticmethod
+    def _index_add(index, key, clid):
+        if key not in index:
+            index[key] = set()
+        index[key].add(clid)
+
+    @staticmethod
+    def _index_discard(index, key, clid):
+        clids = index.get(key)
+        if clids is None:
+            return
+        clids.discard(clid)
+        if not clids:
+            del index[key]
+
+    def _index_client(self, clid):
+        client = self._clientList[clid]
+        if client.cldbid is not None:
+            self._index_add(self._clidsByCldbid, client.cldbid, clid)
+        uid = client.fields.get("client_unique_identifier")
+        if uid is not None:
+            self._clidByUid[uid] = clid
+        if client.client_type == 0:
+            self._normalClients[clid] = None
+            if client.cid is not None:
+                self._channel_index_add(client.cid, clid)
+        for sgid in client.servergroups.values():
+            self._index_add(self._clidsByServergroup, sgid, clid)
+
+    def _unindex_client(self, clid):
+        client = self._clientList[clid]
+        if client.cldbid is not None:
+            self._index_discard(self._clidsByCldbid, client.cldbid, clid)
+        uid = client.fields.get("client_unique_identifier")
+        if uid is not None and self._clidByUid.get(uid) == clid:
+            del self._clidByUid[uid]
+        if clid in self._normalClients:
+            del self._normalClients[clid]
+            if client.cid is not None:
+                self._channel_index_discard(client.cid, clid)
+        for sgid in client.servergroups.values():
+            self._index_discard(self._clidsByServergroup, sgid, clid)
+
+    def _channel_index_add(self, cid, clid):
+        if cid not in self._clidsByChannel:
+            self._occupancyChanges.setdefault(cid, False)
+        self._index_add(self._clidsByChannel, cid, clid)
+
+    def _channel_index_discard(self, cid, clid):
+        clids = self._clidsByChannel.get(cid)
+        if clids is None:
+            return
+        clids.discard(clid)
+        if not clids:
+            del self._clidsByChannel[cid]
+            self._occupancyChanges.setdefault(cid, True)
+
+    def _report_occupancy_changes(self):
+        """!
+        @brief Calls the channel occupancy callback for every channel which became empty or occupied.
+
+        Only the net change since the last report counts, so a channel which is emptied and occupied again
+        within one change, e.g by reindexing a client, is not reported. Emptied channels are reported first.
+
+        @return None
+        """
+        changes = self._occupancyChanges
+        if not changes:
+            return
+        self._occupancyChanges = {}
+        if self._channelOccupancyCallback is None:
+            return
+        emptied = [cid for cid, was_occupied in changes.items() if was_occupied and cid not in self._clidsByChannel]
+        occupied = [cid for cid, was_occupied in changes.items() if not was_occupied and cid in self._clidsByChannel]
+        for cid in emptied:
+            self._channelOccupancyCallback(cid, False)
+        for cid in occupied:
+            self._channelOccupancyCallback(cid, True)
+
+    def set_channel_occupancy_callback(self, callback):
+        """!
+        @brief Sets the function which is called when the number of normal clients in a channel changes
+        from 0 to 1 or from 1 to 0.
+
+        @param callback Called with the cid and True when the channel became occupied, False when it became empty.
+            None removes the callback.
+        @return None
+        """
+        self._channelOccupancyCallback = callback
+
     def get_client_cldbid_by_clid(self, clid):
         clid = int(clid)
         if clid not in self._clientList:
             return None
-        return int(self._clientList[clid]["teamspeak_data"]["client_database_id"])
+        return self._clientList[clid].cldbid
+
+    def get_client_cid_by_clid(self, clid):
+        client = self._clientList.get(int(clid))
+        if client is None:
+            return None
+        return client.cid
+
+    def set_client_cid(self, clid, cid):
+        """!
+        @brief Moves a client to another channel, without the string conversions of set_client_value.
+
+        @param clid The client id
+        @param cid The id of the new channel
+        @return The integer id of the previous channel, None when the client is unknown
+        """
+        clid = int(clid)
+        client = self._clientList.get(clid)
+        if client is None:
+            return None
+        old_cid = client.cid
+        cid = int(cid)
+        if cid != old_cid:
+            self._unindex_client(clid)
+            client.cid = cid
+            self._index_client(clid)
+            self._report_occupancy_changes()
+        return old_cid
 
     def get_client_clid_by_cldbid(self, cldbid):
-        for clid in self._clientList:
-            client = self._clientList[clid]
-            if client["teamspeak_data"]["client_database_id"] == str(cldbid):
-                return int(clid)
-        return None
+        clids = self._clidsByCldbid.get(int(cldbid))
+        if not clids:
+            return None
+        return min(clids)
+
+    def get_client_clid_by_uid(self, uid):
+        return self._clidByUid.get(uid)
 
     def add_client(self, clid, client_data, remote_ip="0.0.0.0"):
-        if self._mysqlManager:
-            self._mysqlManager.add_online_client(client_data["clid"], client_data["client_database_id"],
+        self._add_client(clid, client_data, remote_ip)
+        self._report_occupancy_changes()
+
+    def _add_client(self, clid, client_data, remote_ip="0.0.0.0"):
+        if self._storageManager:
+            self._storageManager.add_online_client(client_data["clid"], client_data["client_database_id"],
                                                  client_data["client_nickname"], remote_ip, self._defaultAccessLevel)
 
-        self._clientList[int(clid)] = {
-            "teamspeak_data": client_data,
-            "custom_data": self._mysqlManager.get_client_values(client_data["client_database_id"]) if self._mysqlManager
-            else {},
-            "servergroups": {}
-        }
+        clid = int(clid)
+        if clid in self._clientList:
+            self._unindex_client(clid)
+        self._clientList[clid] = ClientRecord(
+            client_data,
+            self._storageManager.get_client_values(client_data["client_database_id"]) if self._storageManager else None
+        )
+        if self._storageManager:
+            self._clientList[clid].stored_access_level = self._defaultAccessLevel
+        self._index_client(clid)
 
     def add_clients(self, clients, clear=False):
         if clear:
-            self._clientList.clear()
-            if self._mysqlManager:
-                self._mysqlManager.clear_online_clients()
+            self._clear_clients()
+            if self._storageManager:
+                self._storageManager.clear_online_clients()
         for client in clients:
-            self.add_client(client["clid"], client)
+            self._add_client(client["clid"], client)
+        self._report_occupancy_changes()
 
     def update_client(self, clid, client_data, data_changed_callback=None):
         if not self.has_clid(clid):
@@ -48,35 +273,66 @@ class DataManager:
             self.set_client_value(clid, clientProperty, client_data[clientProperty], True, data_changed_callback)
 
     def update_client_ip(self, clid, remote_ip):
-        if self._mysqlManager is None:
+        if self._storageManager is None:
             return
-        self._mysqlManager.set_client_ip(clid, remote_ip)
+        self._storageManager.set_client_ip(clid, remote_ip)
 
     def update_client_accesslevel(self, clid):
-        if self._mysqlManager is None:
+        if self._storageManager is None:
             return
         accesslevel = self.get_access_level_by_clid(clid)
-        self._mysqlManager.set_client_accesslevel(clid, accesslevel)
+        client = self._clientList.get(int(clid))
+        if client is None or client.stored_access_level == accesslevel:
+            return
+        self._storageManager.set_client_accesslevel(clid, accesslevel)
+        client.stored_access_level = accesslevel
 
     def has_clid(self, clid):
         if int(clid) in self._clientList:
             return True
         return False
 
+    def is_server_query_client(self, clid):
+        client = self._clientList.get(int(clid))
+        return client is not None and client.client_type is not None and client.client_type != 0
+
     def remove_client(self, clid):
-        if self._mysqlManager:
-            self._mysqlManager.remove_online_client(clid)
-        self._clientList.pop(int(clid), None)
+        if self._storageManager:
+            self._storageManager.remove_online_client(clid)
+        clid = int(clid)
+        if clid in self._clientList:
+            self._unindex_client(clid)
+            del self._clientList[clid]
+            self._report_occupancy_changes()
+
+    def _clear_clients(self):
+        for cid in self._clidsByChannel:
+            self._occupancyChanges.setdefault(cid, True)
+        self._clientList.clear()
+        self._normalClients.clear()
+        self._clidsByCldbid.clear()
+        self._clidByUid.clear()
+        self._clidsByChannel.clear()
+        self._clidsByServergroup.clear()
 
     def get_clients(self):
-        wsq = [client for client in self._clientList if
-               self._clientList[client]["teamspeak_data"]["client_type"] == '0']
-        return list(wsq)
+        return list(self._normalClients)
+
+    def get_clients_in_channel(self, cid):
+        return list(self._clidsByChannel.get(int(cid), ()))
+
+    def get_clients_in_servergroup(self, sgid):
+        return list(self._clidsByServergroup.get(int(sgid), ()))
+
+    def get_occupied_channels(self):
+        return list(self._clidsByChannel)
+
+    def get_channel_client_count(self, cid):
+        clids = self._clidsByChannel.get(int(cid))
+        return 0 if clids is None else len(clids)
 
     def get_clients_cldbid(self):
-        wsq = [self._clientList[client]["teamspeak_data"]["client_database_id"] for client in self._clientList if
-               self._clientList[client]["teamspeak_data"]["client_type"] == '0']
-        return list(wsq)
+        return [str(self._clientList[clid].cldbid) for clid in self._normalClients]
 
     def set_client_value(self, clid, key, value, teamspeak_data=False, data_changed_callback=None):
         clid = int(clid)
@@ -85,11 +341,25 @@ class DataManager:
         if clid not in self._clientList:
             return False
 
-        old_value = self.get_client_value(clid, key, None, teamspeak_data)
+        client = self._clientList[clid]
+        slot = ClientRecord.TYPED_FIELDS.get(key) if teamspeak_data else None
+        if slot is not None and value is not None and int(value) == getattr(client, slot):
+            # unchanged integer field, e.g the channel of a client during a refresh
+            return True
 
-        namespace = "teamspeak_data" if teamspeak_data else "custom_data"
+        old_value = self.get_client_value(clid, key, None, teamspeak_data)
 
-        self._clientList[clid][namespace][key] = value
+        if not teamspeak_data:
+            client.custom_data[key] = value
+        elif value == old_value:
+            pass
+        elif key in self._INDEXED_KEYS:
+            self._unindex_client(clid)
+            client.set(key, value)
+            self._index_client(clid)
+            self._report_occupancy_changes()
+        else:
+            client.set(key, value)
 
         if old_value is not None and data_changed_callback is not None and value != old_value:
             data_changed_callback(clid, key, old_value, value)
@@ -110,7 +380,7 @@ class DataManager:
             return self._get_client_value_for_namespace(clid, key, "custom_data", default_value)
 
     def set_persistent_client_value(self, clid, key, value):
-        if self._mysqlManager is None:
+        if self._storageManager is None:
             return
         clid = int(clid)
         cldbid = self.get_client_cldbid_by_clid(clid)
@@ -118,19 +388,17 @@ class DataManager:
             return False
         key = str(key)
 
-        self._mysqlManager.set_client_value(cldbid, key, value)
-        self._clientList[clid]["custom_data"][key] = value
+        self._storageManager.set_client_value(cldbid, key, value)
+        self._clientList[clid].custom_data[key] = value
         return True
 
     def _get_client_value_for_namespace(self, clid, key, namespace, default_value=None):
         clid = int(clid)
         if clid not in self._clientList:
             return default_value
-        if namespace not in self._clientList[clid]:
-            return default_value
-        if key not in self._clientList[clid][namespace]:
-            return default_value
-        return self._clientList[clid][namespace][key]
+        if namespace == "teamspeak_data":
+            return self._clientList[clid].get(key, default_value)
+        return self._clientList[clid].custom_data.get(key, default_value)
 
     def add_client_servergroup(self, clid, sgid, name):
         clid = int(clid)
@@ -138,10 +406,12 @@ class DataManager:
         if not self.has_clid(clid):
             return False
 
-        if name in self._clientList[clid]["servergroups"]:
+        if name in self._clientList[clid].servergroups:
             return True
 
-        self._clientList[clid]["servergroups"][name] = sgid
+        self._clientList[clid].servergroups[name] = sgid
+        self._clientList[clid].access_level = None
+        self._index_add(self._clidsByServergroup, sgid, clid)
         return True
 
     def add_client_servergroups(self, clid, servergroup_dictionary, clear=False):
@@ -149,17 +419,44 @@ class DataManager:
         if not self.has_clid(clid):
             return
         if clear:
-            self._clientList[clid]["servergroups"].clear()
+            self._clear_client_servergroups(clid)
         for servergroup in servergroup_dictionary:
             self.add_client_servergroup(clid, servergroup["sgid"], servergroup["name"])
 
+    def set_client_servergroups(self, clid, sgids, servergroup_names):
+        clid = int(clid)
+        if not self.has_clid(clid):
+            return False
+        servergroups = self._clientList[clid].servergroups
+        if set(servergroups.values()) == sgids:
+            return False
+
+        self._clear_client_servergroups(clid)
+        self._clientList[clid].access_level = None
+        for sgid in sgids:
+            if sgid in servergroup_names:
+                servergroups[servergroup_names[sgid]] = sgid
+                self._index_add(self._clidsByServergroup, sgid, clid)
+        return True
+
+    def _clear_client_servergroups(self, clid):
+        servergroups = self._clientList[clid].servergroups
+        for sgid in servergroups.values():
+            self._index_discard(self._clidsByServergroup, sgid, clid)
+        if servergroups:
+            servergroups.clear()
+            self._clientList[clid].access_level = None
+
     def remove_client_servergroup(self, clid, name):
         clid = int(clid)
         if not self.has_clid(clid):
             return False
 
-        if name in self._clientList[clid]["servergroups"]:
-            self._clientList[clid]["servergroups"].pop(name, None)
+        if name in self._clientList[clid].servergroups:
+            sgid = self._clientList[clid].servergroups.pop(name)
+            self._clientList[clid].access_level = None
+            if sgid not in self._clientList[clid].servergroups.values():
+                self._index_discard(self._clidsByServergroup, sgid, clid)
             return True
         return False
 
@@ -181,27 +478,37 @@ class DataManager:
 
     def set_default_access_level(self, access_level):
         self._defaultAccessLevel = access_level
+        self._invalidate_access_levels()
 
     def set_access_levels(self, access_level_map):
         self._accessLevels = access_level_map
+        self._invalidate_access_levels()
+
+    def _invalidate_access_levels(self):
+        for client in self._clientList.values():
+            client.access_level = None
 
     def get_access_level_by_clid(self, clid):
-        clid = int(clid)
-        if not self.has_clid(clid):
+        client = self._clientList.get(int(clid))
+        if client is None:
             return None
+        if client.access_level is not None:
+            return client.access_level
         highest_access_level = self._defaultAccessLevel
-        for servergroup in self._clientList[clid]["servergroups"]:
+        for servergroup in client.servergroups:
             if servergroup in self._accessLevels and self._accessLevels[servergroup] > highest_access_level:
                 highest_access_level = self._accessLevels[servergroup]
+        client.access_level = highest_access_level
         return highest_access_level
 
     def clear_all_data(self):
-        self._clientList.clear()
+        self._clear_clients()
+        self._report_occupancy_changes()
         self._channelList.clear()
         self._accessLevels.clear()
 
     def set_value(self, key, value):
-        return self._mysqlManager.set_value(key, value)
+        return self._storageManager.set_value(key, value)
 
     def get_value(self, key, default_value=None):
-        return self._mysqlManager.get_value(key, default_value)
+        return self._storageManager.get_value(key, default_value)
@@ -0,0 +1,164 @@
+# coding=utf-8
+import queue
+import threading
+
+from Bot.Utility import monotonic_time
+
+
+class DatabaseExecutor:
+    """!
+    @brief Runs database jobs on a dedicated thread with its own connection.
+
+    Jobs are executed one after another in the order they were submitted. Their results are handed back
+    to the event loop as asyncio futures, so a slow query never blocks the bot.
+    """
+
+    def __init__(self, connection_factory, loop, latency_observer=None):
+        """!
+        @brief Starts the executor thread.
+
+        @param connection_factory Callable returning a connected StorageManager. It is called
+        inside the executor thread, so the connection is never shared with the bot thread.
+        @param loop The asyncio event loop the futures belong to
+        @param latency_observer Optional. Called on the event loop with the milliseconds from submitting
+        a job until its result arrived
+        """
+        self._connectionFactory = connection_factory
+        self._loop = loop
+        self._latencyObserver = latency_observer
+        self._jobs = queue.Queue()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "latency_total": 0,
+            "latency_max": 0
+        }
+        self._thread = threading.Thread(target=self._run, name="DatabaseExecutor", daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """!
+        @brief Calls function(manager, *args) on the executor thread.
+
+        @param function The job. Receives the manager created by the connection factory as first argument
+        @param args Additional arguments for the job
+        @return asyncio.Future which resolves to the return value of the job
+        """
+        future = self._loop.create_future()
+        self._stats["submitted"] += 1
+        self._jobs.put((future, function, args, monotonic_time()))
+        return future
+
+    def execute_query(self, sql_query, *args):
+        """!
+        @brief Executes a query on the executor thread.
+
+        @param sql_query The query, with %s placeholders for args
+        @param args The query parameters
+        @return asyncio.Future which resolves to a list of rows, each row being a dictionary
+        """
+        return self.submit(lambda manager: manager.fetch_all(sql_query, *args))
+
+    def get_stats(self):
+        """!
+        @brief Returns job counters. Latencies are measured from submit until the result is back
+        on the event loop, in milliseconds.
+
+        @return Dictionary
+        """
+        stats = dict(self._stats)
+        stats["queued"] = self._jobs.qsize()
+        stats["latency_avg"] = stats["latency_total"] / stats["completed"] if stats["completed"] else 0
+        return stats
+
+    def drain(self):
+        """!
+        @brief Blocks until all jobs submitted so far were executed. Their futures are resolved later,
+        once the event loop runs again.
+
+        @return None
+        """
+        if not self._thread.is_alive():
+            return
+        drained = threading.Event()
+        self._jobs.put(drained)
+        drained.wait()
+
+    def shutdown(self, wait=True):
+        """!
+        @brief Stops the executor thread after all submitted jobs were executed.
+
+        @param wait Whether to block until the thread finished
+        @return None
+        """
+        self._jobs.put(None)
+        if wait:
+            self._thread.join()
+
+    def _run(self):
+        manager = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if isinstance(job, threading.Event):
+                # put by drain, all jobs before it were executed
+                job.set()
+                continue
+            future, function, args, submitted_at = job
+            if manager is None:
+                try:
+                    manager = self._connectionFactory()
+                except Exception as e:
+                    self._fail_queued_jobs(job, e)
+                    continue
+            try:
+                result = function(manager, *args)
+            except Exception as e:
+                self._resolve(future, submitted_at, None, e)
+            else:
+                self._resolve(future, submitted_at, result, None)
+
+    def _fail_queued_jobs(self, job, exception):
+        """!
+        @brief Fails a job and all jobs queued after it, as none of them can run without a connection.
+        The next job submitted afterwards tries to connect again.
+        """
+        self._resolve(job[0], job[3], None, exception)
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is None:
+                # keep the shutdown request for the loop in _run
+                self._jobs.put(None)
+                return
+            if isinstance(job, threading.Event):
+                job.set()
+                continue
+            self._resolve(job[0], job[3], None, exception)
+
+    def _resolve(self, future, submitted_at, result, exception):
+        try:
+            self._loop.call_soon_threadsafe(self._set_future, future, submitted_at, result, exception)
+        except RuntimeError:
+            # the event loop was closed, nobody is waiting for the result anymore
+            pass
+
+    def _set_future(self, future, submitted_at, result, exception):
+        latency = monotonic_time() - submitted_at
+        self._stats["completed"] += 1
+        self._stats["latency_total"] += latency
+        self._stats["latency_max"] = max(self._stats["latency_max"], latency)
+        if self._latencyObserver is not None:
+            self._latencyObserver(latency)
+        if exception is not None:
+            self._stats["failed"] += 1
+        if future.cancelled():
+            return
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
@@ -1,4 +1,6 @@
 # coding=utf-8
+import asyncio
+import functools
 import inspect
 from enum import Enum
 import socket
@@ -6,14 +8,20 @@ import socket
 import queue
 import UnixServer
 import Network
-import Bot.MysqlManager
+import Bot.DatabaseExecutor
+import Bot.Metrics
+import Bot.PluginExecutor
 import Bot.QueryManager
 import Bot.DataManager
 import importlib
 import os
 import signal
+import traceback
 
-from Bot.Utility import starts_with_c_i, normalize_message, Event, escape, Timer, ChatCommand
+from Bot.QueryManager import CommandPriority
+from Bot.StorageManager import DatabaseConnectionError
+from Bot.Utility import starts_with_c_i, normalize_message, normalize_message_lazy, Event, escape, Timer, ChatCommand, \
+    monotonic_time, PluginDispatcher
 
 from Globals import config
 
@@ -33,7 +41,36 @@ class CommandResults(Enum):
 
 
 class TeamspeakBot:
-    def __init__(self, ip, port=10011, user=None, password=None, virtual_server_id=None, minimal=False):
+    # Upper bound for wait_for_events, also the interval in which reconnects are attempted
+    MAX_WAIT_TIME = 1000
+    # Default for the query_timeout config value in milliseconds
+    DEFAULT_QUERY_TIMEOUT = 10000
+    # When the oldest query waits this many timeouts for its answer, the connection is considered out of sync
+    QUERY_STALL_FACTOR = 3
+    # Default for the serverquery.flood_time config value in seconds, the same as the teamspeak server default
+    DEFAULT_FLOOD_TIME = 3
+    # Error id the server answers with when the query client is flooding
+    FLOOD_ERROR_ID = 524
+    # Returns most clientinfo fields for all clients at once, used to refresh the client data
+    BULK_CLIENTLIST_COMMAND = "clientlist -uid -away -voice -times -groups -info -country -ip"
+    # Minimum milliseconds between two clientinfo updates of all clients in bulk mode, done when a value
+    # changed callback watches a field only clientinfo returns
+    CLIENTINFO_FALLBACK_INTERVAL = 5000
+    # Defaults for the plugin_threads config values
+    DEFAULT_PLUGIN_THREADS = 4
+    DEFAULT_PLUGIN_BUDGET = 1000
+    # Defaults for the channel_slaves config values
+    DEFAULT_SLAVE_POOL_SIZE = 5
+    DEFAULT_SLAVE_IDLE_TIMEOUT = 300000
+    # Slaves follow the channel occupancy as it changes, this interval only reconciles what might have been missed
+    SLAVE_RESYNC_INTERVAL = 60000
+    # Interval of the event loop lag probe in milliseconds
+    LOOP_LAG_INTERVAL = 1000
+    # Default for the metrics.http_host config value
+    DEFAULT_METRICS_HOST = "127.0.0.1"
+
+    def __init__(self, ip, port=10011, user=None, password=None, virtual_server_id=None, minimal=False, reactor=None,
+                 timer=None):
         """!
         @brief Constructs a TeamspeakBot instance
 
@@ -43,11 +80,14 @@ class TeamspeakBot:
         @param password Serverquery password
         @param virtual_server_id The virtual id of the serverr you want the bot to manage
         @param minimal Initializes a minimal bot version.
-            The following will not be initialized: mysql, timer, plugins, ts3speech
+            The following will not be initialized: database, timer, plugins, ts3speech
+        @param reactor The reactor to register the connection with. A new one is created when omitted.
+        @param timer The Timer to start the timers of this bot on. A new one is created when omitted.
         """
 
         self._conn = None
         self._my_clid = None
+        self._reactor = reactor if reactor is not None else Network.Reactor()
 
         self._init_networking(ip, port)
         self._ip = ip
@@ -58,17 +98,48 @@ class TeamspeakBot:
         self._virtualServerId = virtual_server_id
 
         self._queryTracker = Bot.QueryManager.QueryTracker()
+        self._query_timeout = config.get_value("query_timeout")
+        if self._query_timeout is None:
+            self._query_timeout = self.DEFAULT_QUERY_TIMEOUT
+
+        flood_commands = config.get_value("serverquery.flood_commands")
+        flood_bucket = None
+        if flood_commands:
+            flood_time = config.get_value("serverquery.flood_time") or self.DEFAULT_FLOOD_TIME
+            flood_bucket = Bot.QueryManager.TokenBucket(flood_commands, flood_time * 1000)
+        self._commandScheduler = Bot.QueryManager.CommandScheduler(self._send_query, flood_bucket,
+                                                                   self._on_query_not_sent)
 
         self._slaves = {}  # cid: slave_instance
-        self._plugin_list = []
+        self._idleSlaves = []  # (slave_instance, idle since), the longest idle slave first
+        self._slaveReleaseTimers = {}  # cid: id of the timer removing the slave of that empty channel
+        self._slavePoolStats = {
+            "created": 0,
+            "reused": 0,
+            "evicted": 0,
+            "connects": 0,
+            "connect_failures": 0,
+            "connect_latency_total": 0,
+            "connect_latency_max": 0
+        }
+        # imported here, as the module of the plugin base class imports this module
+        from Bot.Plugins.Base import PluginBase
+        self._pluginDispatcher = PluginDispatcher(PluginBase, self._wrap_plugin_handler)
+        self._pluginExecutor = None
         self._command_prefix = config.get_value("command_prefix")
 
         self._lastLine = ""
+        # Lazy records parse a record of an answer only when a callback accesses it
+        self._normalize_message = normalize_message_lazy if config.get_value("lazy_records") else normalize_message
 
-        self._timer = Timer()
-        self._timer.start_timer(self._send_heartbeat, 60000, False)
-        self._timer.start_timer(lambda: self._queryTracker.clean_up(), 60000, False)
+        self._timer = timer if timer is not None else Timer()
+        self._heartbeatTimer = self._timer.start_timer(self._send_heartbeat, 60000, False)
+        self._queryTimeoutTimer = self._timer.start_timer(self._check_query_timeouts, 1000, False)
 
+        self._metrics = None
+        self._metricsServer = None
+        # whether plugin hooks and chat commands are timed, only when the metrics are exported
+        self._timeCallbacks = False
         self.minimal = minimal
         if minimal:
             self._dataManager = Bot.DataManager.DataManager(None)
@@ -76,14 +147,32 @@ class TeamspeakBot:
             self._dataManager.set_access_levels(config.get_value("accesslevel.groups"))
             return
 
-        self._mysqlManager = Bot.MysqlManager.MysqlManager()
-        self._mysqlManager.connect_to_db(config.get_value("mysql.host"),
-                                         config.get_value("mysql.port"),
-                                         config.get_value("mysql.user"),
-                                         config.get_value("mysql.password"),
-                                         config.get_value("mysql.db"))
+        self._init_metrics()
 
-        self._dataManager = Bot.DataManager.DataManager(self._mysqlManager)
+        # the config section of the storage backend, it also holds the cache and write_behind settings
+        storage = self._get_storage_backend()
+        try:
+            self._storageManager = self._create_storage_manager()
+        except DatabaseConnectionError as e:
+            print(e)
+            exit()
+        self._storageManager.set_latency_observer(self._observe_database_latency)
+        # opt-in, plugins writing the settings tables with raw queries would read outdated values from the cache
+        cache_size = config.get_value(storage + ".cache.size")
+        if cache_size:
+            cache_ttl = config.get_value(storage + ".cache.ttl")
+            self._storageManager.enable_cache(cache_size, 60000 if cache_ttl is None else cache_ttl)
+
+        self._databaseExecutor = None
+        if config.get_value(storage + ".write_behind.enabled"):
+            self._storageManager.enable_write_behind(
+                config.get_value(storage + ".write_behind.max_pending") or 500,
+                self._get_database_executor() if config.get_value(storage + ".write_behind.background") else None
+            )
+            self._timer.start_timer(self._storageManager.flush,
+                                    config.get_value(storage + ".write_behind.flush_interval") or 250, False)
+
+        self._dataManager = Bot.DataManager.DataManager(self._storageManager)
         self._dataManager.set_default_access_level(config.get_value("accesslevel.default"))
         self._dataManager.set_access_levels(config.get_value("accesslevel.groups"))
 
@@ -91,16 +180,44 @@ class TeamspeakBot:
         self.ts3speech_socket = False
         if ts3speech_socket != "":
             self.ts3speech_queue = queue.Queue()
-            self.ts3speech_server = UnixServer.UnixServer(self.ts3speech_queue, ts3speech_socket)
+            self.ts3speech_server = UnixServer.UnixServer(self.ts3speech_queue, ts3speech_socket,
+                                                          self._reactor.wakeup)
             self.ts3speech_server.start()
             self.ts3speech_socket = True
 
+        bulk_client_updates = config.get_value("bulk_client_updates")
+        self._bulk_client_updates = bulk_client_updates is None or bulk_client_updates
+        # Fields contained in the answer to BULK_CLIENTLIST_COMMAND, known after the first answer arrived
+        self._bulk_client_fields = None
+        # Fields contained in the answer to clientinfo, known after the first answer arrived
+        self._clientinfo_fields = None
+        self._lastClientinfoFallback = None
+        self._clientUpdateStats = {
+            "bulk_updates": 0,
+            "clientinfo_fallbacks": 0,
+            "clientinfo_queries": 0
+        }
+        # sgid -> name, filled from servergrouplist. Empty until the first answer arrived
+        self._servergroupNames = {}
+        self._servergroupListPending = False
+        # sgids which were missing in the servergrouplist, so that it is not requested again on every tick
+        self._missingServergroups = set()
         self._timer.start_timer(self._update_all_clients, 250, False)
-        self._timer.start_timer(self._update_all_client_servergroups, 250, False)
+        if self._bulk_client_updates:
+            self._timer.start_timer(self._update_servergroup_list, 60000, False)
+        else:
+            self._timer.start_timer(self._update_all_client_servergroups, 250, False)
         self._timer.start_timer(self._update_all_client_db_accesslevel, 60000, False)
 
+        slave_pool_size = config.get_value("channel_slaves.pool_size")
+        self._slavePoolSize = self.DEFAULT_SLAVE_POOL_SIZE if slave_pool_size is None else slave_pool_size
+        self._slaveIdleTimeout = config.get_value("channel_slaves.idle_timeout") or self.DEFAULT_SLAVE_IDLE_TIMEOUT
+        self._slaveReleaseDelay = config.get_value("channel_slaves.release_delay") or 0
+        self._slaveParkingChannel = config.get_value("channel_slaves.parking_channel")
         if config.get_value("channel_text"):
-            self._timer.start_timer(self._update_slaves, 250, False)
+            self._dataManager.set_channel_occupancy_callback(self._on_channel_occupancy_changed)
+            self._timer.start_timer(self._update_slaves, self.SLAVE_RESYNC_INTERVAL, False)
+            self._timer.start_timer(self._evict_idle_slaves, 1000, False)
         self.bot_name = config.get_value("bot_name") or "Bot"
         self._callbacksValueChanged = {}
         self._chatCommands = {}
@@ -112,6 +229,13 @@ class TeamspeakBot:
 
     def shutdown_signal(self, signum, frame):
         self.ts3speech_server.shutdown_flag.set()
+        self._storageManager.flush(False)
+        if self._databaseExecutor is not None:
+            self._databaseExecutor.shutdown()
+        if self._pluginExecutor is not None:
+            self._pluginExecutor.shutdown()
+        if self._metricsServer is not None:
+            self._metricsServer.close()
         self.disconnect()
         self._conn.clear_message_buffer()
         self._dataManager.clear_all_data()
@@ -119,6 +243,65 @@ class TeamspeakBot:
         self._remove_all_slaves()
         exit(signum)
 
+    def _init_metrics(self):
+        """!
+        @brief Creates the metrics of the bot and starts serving them when the metrics config section
+        enables an HTTP port or a unix socket.
+
+        @return None
+        """
+        self._metrics = Bot.Metrics.MetricsRegistry()
+        self._loopLagMetric = self._metrics.histogram(
+            "ts3bot_event_loop_lag_seconds", "Delay of the timers behind their schedule")
+        self._queryRttMetric = self._metrics.histogram(
+            "ts3bot_query_rtt_seconds", "Time from sending a query until its error line arrived", ("command",))
+        self._metrics.gauge("ts3bot_queries_in_flight", "Queries which were sent but not answered yet",
+                            function=self._queryTracker.get_in_flight_count)
+        self._pluginHookMetric = self._metrics.histogram(
+            "ts3bot_plugin_hook_seconds", "Execution time of plugin hooks", ("plugin", "hook"))
+        self._chatCommandMetric = self._metrics.histogram(
+            "ts3bot_chat_command_seconds", "Execution time of chat command callbacks", ("plugin", "command"))
+        self._metrics.gauge("ts3bot_channel_slaves", "Channel slaves by state", ("state",),
+                            function=lambda: {("active",): len(self._slaves), ("idle",): len(self._idleSlaves)})
+        self._databaseMetric = self._metrics.histogram(
+            "ts3bot_database_query_seconds", "Latency of database queries", ("operation",))
+
+        self._loopLagDeadline = monotonic_time() + self.LOOP_LAG_INTERVAL
+        self._timer.start_timer(self._measure_loop_lag, self.LOOP_LAG_INTERVAL, True)
+
+        http_port = config.get_value("metrics.http_port")
+        unix_socket = config.get_value("metrics.unix_socket")
+        if not http_port and not unix_socket:
+            return
+        self._timeCallbacks = True
+        self._metricsServer = Bot.Metrics.MetricsServer(self._metrics, self._reactor.loop)
+        try:
+            if http_port:
+                self._metricsServer.listen_tcp(config.get_value("metrics.http_host") or self.DEFAULT_METRICS_HOST,
+                                               http_port)
+            if unix_socket:
+                self._metricsServer.listen_unix(unix_socket)
+        except OSError as e:
+            print("Could not start serving metrics: " + str(e))
+
+    def _measure_loop_lag(self):
+        now = monotonic_time()
+        self._loopLagMetric.observe(max(now - self._loopLagDeadline, 0) / 1000)
+        self._loopLagDeadline = now + self.LOOP_LAG_INTERVAL
+        self._timer.start_timer(self._measure_loop_lag, self.LOOP_LAG_INTERVAL, True)
+
+    def _observe_database_latency(self, operation, milliseconds):
+        self._databaseMetric.observe(milliseconds / 1000, operation)
+
+    def get_metrics(self):
+        """!
+        @brief Returns the metrics registry of the bot. Plugins can add their own metrics to it, they are
+        exported together with the metrics of the bot. Render it with get_metrics().render().
+
+        @return Bot.Metrics.MetricsRegistry, None for channel slaves
+        """
+        return self._metrics
+
     def _setup_plugins(self):
         """!
         @brief initializes all plugins which are located in ./Plugins. All classes which end in Plugin will be loaded.
@@ -148,11 +331,142 @@ class TeamspeakBot:
             available_classes = inspect.getmembers(imported_plugins, inspect.isclass)
             for classes in available_classes:
                 if classes[0].endswith("Plugin"):
-                    self._plugin_list.append(getattr(imported_plugins, classes[0])(self))
+                    self.register_plugin(getattr(imported_plugins, classes[0])(self))
 
-        self._plugin_list = sorted(self._plugin_list, key=lambda plugin: plugin.order)
+    def register_plugin(self, plugin):
+        """!
+        @brief Loads a plugin instance, e.g one which is not located in ./Plugins.
 
-        pass
+        The plugin will receive the callbacks it implements from now on, in the order given by plugin.order.
+
+        @param plugin An instance of a PluginBase subclass
+        @return None
+        """
+        self._pluginDispatcher.register(plugin)
+
+    def unregister_plugin(self, plugin):
+        """!
+        @brief Unloads a plugin instance. It will not receive any callbacks anymore.
+
+        Chat commands the plugin added stay registered.
+
+        @param plugin The plugin instance
+        @return Boolean. False when the plugin was not loaded.
+        """
+        return self._pluginDispatcher.unregister(plugin)
+
+    def get_plugins(self):
+        """!
+        @brief Returns the loaded plugin instances, in the order they receive callbacks.
+
+        @return List
+        """
+        return self._pluginDispatcher.get_plugins()
+
+    def _wrap_plugin_handler(self, handler):
+        """!
+        @brief Returns the callable to put into the dispatch lists for a plugin hook.
+
+        @param handler The bound method of the hook
+        @return The handler, a function timing it when the metrics are exported, or a function running it on
+            the plugin thread pool when it is offloaded
+        """
+        if Bot.PluginExecutor.is_offloaded(handler):
+            return self._offload(handler, self._pluginHookMetric, handler.__name__)
+        if self._timeCallbacks:
+            return self._time_callback(handler, self._pluginHookMetric, handler.__name__)
+        return handler
+
+    @staticmethod
+    def _get_callback_owner_name(callback):
+        owner = getattr(callback, "__self__", None)
+        return callback.__qualname__ if owner is None else type(owner).__name__
+
+    def _time_callback(self, callback, histogram, label):
+        """!
+        @brief Wraps a callback so that its execution time is recorded in a histogram. Coroutines are timed
+        until they finished.
+
+        @param callback The callback, usually a bound method of a plugin
+        @param histogram Histogram with the labels plugin and a second one
+        @param label The value of the second label
+        @return The wrapping function
+        """
+        name = self._get_callback_owner_name(callback)
+
+        def run_timed(*args):
+            start = monotonic_time()
+            try:
+                result = callback(*args)
+            except Exception:
+                histogram.observe((monotonic_time() - start) / 1000, name, label)
+                raise
+            if asyncio.iscoroutine(result):
+                return self._time_coroutine(result, start, histogram, name, label)
+            histogram.observe((monotonic_time() - start) / 1000, name, label)
+            return result
+        return run_timed
+
+    @staticmethod
+    async def _time_coroutine(coroutine, start, histogram, *label_values):
+        try:
+            return await coroutine
+        finally:
+            histogram.observe((monotonic_time() - start) / 1000, *label_values)
+
+    def _offload(self, callback, histogram, label):
+        """!
+        @brief Wraps a callback marked with offload.
+
+        The plugin the callback belongs to gets a BotProxy as bot_instance, so that the calls it makes
+        from the thread pool are executed on the bot thread. Events are passed as copies whose Bot
+        member is that proxy as well, lists of records as lists of plain dictionaries.
+
+        @param callback The callback, usually a bound method of a plugin
+        @param histogram Histogram with the labels plugin and a second one, records the execution time
+        @param label The value of the second label
+        @return A function which returns a coroutine, awaiting the result of the callback on the thread pool
+        """
+        executor = self._get_plugin_executor()
+        owner = getattr(callback, "__self__", None)
+        name = self._get_callback_owner_name(callback)
+        proxy = Bot.PluginExecutor.BotProxy(self, self._reactor.loop, executor)
+        if getattr(owner, "bot_instance", None) is self:
+            owner.bot_instance = proxy
+        budget = executor.get_budget(owner, callback)
+
+        def observe(duration):
+            histogram.observe(duration / 1000, name, label)
+
+        def run_offloaded(*args):
+            args = tuple(Bot.PluginExecutor.detach_argument(arg, proxy) for arg in args)
+            return executor.run(name, callback, args, budget, observe)
+        return run_offloaded
+
+    def _get_plugin_executor(self):
+        """!
+        @brief Returns the thread pool for offloaded plugin callbacks, creating it on first use.
+
+        @return Bot.PluginExecutor.PluginExecutor
+        """
+        if self._pluginExecutor is None:
+            budget = config.get_value("plugin_threads.budget")
+            self._pluginExecutor = Bot.PluginExecutor.PluginExecutor(
+                self._reactor.loop,
+                config.get_value("plugin_threads.workers") or self.DEFAULT_PLUGIN_THREADS,
+                self.DEFAULT_PLUGIN_BUDGET if budget is None else budget or None
+            )
+        return self._pluginExecutor
+
+    def get_plugin_executor_stats(self):
+        """!
+        @brief Returns call counts, budget overruns and execution times of offloaded plugin callbacks, per plugin.
+
+        @return Dictionary, empty when no plugin offloads callbacks
+        """
+        if self._pluginExecutor is None:
+            return {}
+        return self._pluginExecutor.get_stats()
 
     def _init_networking(self, ip, port):
         """!
@@ -163,7 +477,7 @@ class TeamspeakBot:
         @return None
         """
 
-        self._conn = Network.TCPConnection(ip, port)
+        self._conn = Network.TCPConnection(ip, port, self._reactor)
 
     def connect(self):
         """!
@@ -176,6 +490,7 @@ class TeamspeakBot:
 
         try:
             self._conn.connect()
+            self._commandScheduler.reset()
             return True
         except ConnectionRefusedError:
             return False
@@ -189,6 +504,15 @@ class TeamspeakBot:
 
         self._conn.disconnect()
 
+    def is_connected(self):
+        """!
+        @brief Returns whether the query connection is established.
+
+        @return Boolean
+        """
+
+        return self._conn.is_connected()
+
     def _message_available(self):
         """!
         @brief Returns whether the network connection holds a message which ends with \n\r.
@@ -215,6 +539,27 @@ class TeamspeakBot:
         except socket.error:
             self._call_callbacks(None, EventTypes.LOST_CONNECTION)
 
+    def wait_for_events(self, max_timeout=MAX_WAIT_TIME):
+        """!
+        @brief Blocks until there is something to process.
+
+        Returns as soon as the query connection, a slave connection or the ts3speech socket
+        received data, or when the next timer is due. Slaves share the timer of the bot.
+        Call process afterwards.
+
+        @param max_timeout The maximum time to block in milliseconds
+        @return None
+        """
+
+        timeout = max_timeout
+        time_until_next_timer = self._timer.get_time_until_next_timer()
+        if time_until_next_timer is not None and time_until_next_timer < timeout:
+            timeout = time_until_next_timer
+        time_until_next_send = self._commandScheduler.get_time_until_next_send()
+        if time_until_next_send is not None and time_until_next_send < timeout:
+            timeout = time_until_next_send
+        self._reactor.wait(timeout)
+
     def process(self):
         """!
         @brief Processes every message.
@@ -223,6 +568,9 @@ class TeamspeakBot:
         checks for timers which need to be called. When the bot lost connection, this function
         will also try to reestablish a connection.
 
+        Slaves are not processed one by one, the reactor hands their connections to them only when
+        they received data.
+
         @return None
         """
 
@@ -231,12 +579,11 @@ class TeamspeakBot:
             event = Event([{"clid": item[0], "text": item[1].decode("utf-8")}])
             self._call_callbacks(event, EventTypes.CLIENT_SAY)
 
-        while self._conn.is_connected() and self._message_available():
-            self._handle_message()
+        self._process_messages()
+
+        self._commandScheduler.flush()
 
-        for idx in self._slaves:
-            slave = self._slaves[idx]
-            slave.process()
+        self._reactor.dispatch()
 
         if hasattr(self, "_timer"):
             self._timer.check_timers()
@@ -245,6 +592,16 @@ class TeamspeakBot:
             if self.connect():
                 self.login_use()
 
+    def _process_messages(self):
+        """!
+        @brief Handles every message the connection received.
+
+        @return None
+        """
+
+        while self._conn.is_connected() and self._message_available():
+            self._handle_message()
+
     def _handle_message(self):
         message = self._get_next_message()
         self._translate_message(message)
@@ -263,7 +620,7 @@ class TeamspeakBot:
                                           "information on a specific command.":
             return
 
-        args = normalize_message(message)
+        args = self._normalize_message(message)
         if starts_with_c_i(message, "notify"):
             if message == self._lastLine:
                 self._lastLine = message
@@ -282,7 +639,16 @@ class TeamspeakBot:
 
         if starts_with_c_i(message, "error"):
             query = self._queryTracker.complete_last_query()
+            if query is None:
+                self._resync("received an answer without a query: " + message)
+                return
+            if self._metrics is not None:
+                self._queryRttMetric.observe((monotonic_time() - query.sent_at) / 1000, query.text.split(" ", 1)[0])
+            if query.timed_out:
+                return
             error_id = args[0]["id"]
+            if int(error_id) == self.FLOOD_ERROR_ID:
+                self._commandScheduler.penalize()
             if int(error_id) != 0:
                 event = Event(args)
                 event.data = {
@@ -294,10 +660,17 @@ class TeamspeakBot:
                 event = Event(args)
                 event.data = query.data
                 query.errCallback(event)
+            query.resolve(error_id, args[0].get("msg", ""))
             return
 
         # Must be a query response
         query = self._queryTracker.get_last_uncompleted_query()
+        if query is None:
+            self._resync("received an answer without a query: " + message)
+            return
+        if query.timed_out:
+            return
+        query.response = args
         event = Event(args)
         event.data = query.data
         if query.callback:
@@ -307,7 +680,8 @@ class TeamspeakBot:
         """!
         @brief Calls a method on all plugins
 
-        Iterates through all plugins and calls the given method.
+        Iterates through all plugins implementing the given method and calls it. Plugins which
+        inherit the empty implementation of PluginBase are skipped.
         Can receive multiple arguments after the method name which are passed onto the called function
 
         @param method_name The method which to call
@@ -315,8 +689,10 @@ class TeamspeakBot:
         @return None
         """
 
-        for plugin in self._plugin_list:
-            getattr(plugin, method_name)(*args)
+        for handler in self._pluginDispatcher.get_handlers(method_name):
+            result = handler(*args)
+            if asyncio.iscoroutine(result):
+                self.create_task(result)
 
     def _call_callbacks(self, event, event_type):
         """!
@@ -340,35 +716,27 @@ class TeamspeakBot:
             # self._callMethodOnAllPlugins("on_client_joined", event)
 
         if event_type == EventTypes.CLIENT_LEFT:
-            if self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None, True) is not None and \
-                            int(self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None,
-                                                                   True)) != 0:
+            if self._dataManager.is_server_query_client(event.args[0]["clid"]):
                 self._on_client_left(event)
                 return
             self._call_method_on_all_plugins("on_client_left", event)
             self._on_client_left(event)
 
         if event_type == EventTypes.CLIENT_MOVED:
-            if self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None, True) is not None and \
-                            int(self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None,
-                                                                   True)) != 0:
+            if self._dataManager.is_server_query_client(event.args[0]["clid"]):
                 return
             event = self._on_client_moved(event)
             self._call_method_on_all_plugins("on_client_moved", event)
 
         if event_type == EventTypes.TEXT:
-            if self._dataManager.get_client_value(event.args[0]["invokerid"], "client_type", None, True) is not None \
-                    and int(
-                        self._dataManager.get_client_value(event.args[0]["invokerid"], "client_type", None, True)) != 0:
+            if self._dataManager.is_server_query_client(event.args[0]["invokerid"]):
                 return
             event = self._on_text(event)
             if event:
                 self._call_method_on_all_plugins("on_private_text", event)
 
         if event_type == EventTypes.CLIENT_SAY:
-            if self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None, True) is not None \
-                    and int(
-                        self._dataManager.get_client_value(event.args[0]["clid"], "client_type", None, True)) != 0:
+            if self._dataManager.is_server_query_client(event.args[0]["clid"]):
                 return
             self._call_method_on_all_plugins("on_client_say", event)
 
@@ -398,42 +766,48 @@ class TeamspeakBot:
         # we're going to force that here
         event.args[0]["cid"] = event.args[0]["ctid"]
 
-        self.send_command("clientinfo clid=%s" % str(clid), self._on_client_joined_updated_clientinfo,
-                          {"join_data": event.args[0], "event": event})
+        self.create_task(self._complete_client_join(event))
 
         return event
 
-    def _on_client_joined_updated_clientinfo(self, event):
+    async def _complete_client_join(self, event):
         """!
-        Called as a callback after a client joined. Adds additional data to the client connected event so that
-        callbacks will receive a complete data set of that client. Will call servergroupsbyclientid on the
-        connected client and pass control over to the callback on_client_joined_updated_servergroups.
-
-        @param event The event object containing data related to the sent query
-        @return None
-        """
+        @brief Completes the data of a joined client, adds it to the data manager and calls the plugin callbacks.
 
-        complete_client_data = event.args[0].copy()
-        complete_client_data.update(event.data["join_data"])
-        self.send_command("servergroupsbyclientid cldbid=%s" % str(complete_client_data["client_database_id"]),
-                          self._on_client_joined_updated_servergroups,
-                          {"complete_client_data": complete_client_data, "event": event.data["event"]})
+        Queries clientinfo and the servergroups of the client, so that callbacks will receive a
+        complete data set of that client.
 
-    def _on_client_joined_updated_servergroups(self, event):
-        """!
-        Adds the client groups to the event object and will finally call the plugin callbacks
-        as well as add the client to the data manager.
-
-        @param event The event object containing data related to the sent query
+        @param event The event object of the join, which will be passed to the plugins
         @return None
         """
 
-        clid = event.data["complete_client_data"]["clid"]
-        self._dataManager.add_client(clid, event.data["complete_client_data"])
-        self._dataManager.add_client_servergroups(clid, event.args, True)
+        join_data = event.args[0]
+        servergroups = None
+        try:
+            client_info = await self.query("clientinfo clid=%s" % str(join_data["clid"]))
+            if self._clientinfo_fields is None:
+                self._clientinfo_fields = set(client_info[0].keys())
+            complete_client_data = client_info[0].copy()
+            complete_client_data.update(join_data)
+            if not self._bulk_client_updates or not self._servergroupNames:
+                servergroups = await self.query("servergroupsbyclientid cldbid=%s" %
+                                                str(complete_client_data["client_database_id"]))
+        except Bot.QueryManager.QueryError:
+            # The client most likely left in the meantime
+            return
+        except ConnectionError:
+            # The bot was disconnected, the client data is requested again after reconnecting
+            return
+
+        clid = complete_client_data["clid"]
+        self._dataManager.add_client(clid, complete_client_data)
+        if servergroups is None:
+            self._apply_client_servergroups(clid)
+        else:
+            self._dataManager.add_client_servergroups(clid, servergroups, True)
         self._update_client_db_accesslevel(clid)
         self._update_client_remote_ip(clid)
-        self._call_method_on_all_plugins("on_client_joined", event.data["event"])
+        self._call_method_on_all_plugins("on_client_joined", event)
 
     def _on_client_left(self, event):
         """!
@@ -456,9 +830,8 @@ class TeamspeakBot:
 
         clid = event.args[0]["clid"]
         ctid = event.args[0]["ctid"]
-        old_channel = self._dataManager.get_client_value(clid, "cid", None, True)
-        self._dataManager.set_client_value(clid, "cid", ctid, True)
-        event.args[0]["cid"] = old_channel
+        old_channel = self._dataManager.set_client_cid(clid, ctid)
+        event.args[0]["cid"] = None if old_channel is None else str(old_channel)
         return event
 
     def _on_text(self, event):
@@ -495,10 +868,15 @@ class TeamspeakBot:
         invoker_access_level = self._dataManager.get_access_level_by_clid(invokerid)
         if invoker_access_level is None or chat_command.accesslevel > invoker_access_level:
             self.send_command("sendtextmessage targetmode=1 target=%s msg=%s" %
-                              (invokerid, escape("Your accesslevel is not high enough for this command.")))
+                              (invokerid, escape("Your accesslevel is not high enough for this command.")),
+                              priority=CommandPriority.INTERACTIVE)
             return event
 
         result = chat_command.callback(int(invokerid), invokername, invokeruid, msg_splitted[1:])
+        if asyncio.iscoroutine(result):
+            task = self.create_task(result)
+            task.add_done_callback(functools.partial(self._on_command_task_done, invokerid, chat_command))
+            return event
         self._process_command_result(invokerid, chat_command, result)
 
         return event
@@ -516,6 +894,19 @@ class TeamspeakBot:
                                                                                      chat_command.original_command,
                                                                                      " ".join(chat_command.args)))
 
+    def _on_command_task_done(self, invokerid, chat_command, task):
+        """!
+        @brief Processes the result of a command callback which was a coroutine.
+
+        @param invokerid The client id of the client who used the command
+        @param chat_command The used command
+        @param task The finished task of the command callback
+        @return None
+        """
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._process_command_result(invokerid, chat_command, task.result())
+
     def _on_channel_text(self, event):
         if int(event.args[0]["targetmode"]) != 2:
             return False
@@ -542,7 +933,9 @@ class TeamspeakBot:
         if invoker_access_level is None or chat_command.accesslevel > invoker_access_level:
             return self._call_method_on_all_plugins("on_channel_text", event)
 
-        chat_command.callback(int(invokerid), invokername, invokeruid, msg_splitted[1:])
+        result = chat_command.callback(int(invokerid), invokername, invokeruid, msg_splitted[1:])
+        if asyncio.iscoroutine(result):
+            self.create_task(result)
         return self._call_method_on_all_plugins("on_channel_text", event)
 
     def _on_connection_lost(self):
@@ -557,6 +950,7 @@ class TeamspeakBot:
         self._conn.clear_message_buffer()
         self._dataManager.clear_all_data()
         self._queryTracker.reset()
+        self._commandScheduler.reset()
         self._remove_all_slaves()
 
     def _set_bot_name(self):
@@ -569,15 +963,86 @@ class TeamspeakBot:
 
     def _update_all_clients(self):
         """!
-        @brief Iterates through all online clients and calls _update_client on them
+        @brief Refreshes the data of all online clients.
+
+        In bulk mode a single clientlist is requested for all clients. Otherwise _update_client
+        is called on every client.
 
         @return None
         """
 
+        if self._bulk_client_updates:
+            self.send_command(self.BULK_CLIENTLIST_COMMAND, self._on_bulk_clientlist,
+                              priority=CommandPriority.BACKGROUND)
+            return
+
         online_clients = self._dataManager.get_clients()
         for clid in online_clients:
             self._update_client(clid)
 
+    def _on_bulk_clientlist(self, event):
+        """!
+        @brief Diffs the received clientlist against the data manager.
+
+        _on_client_value_changed is called for every changed value. When value changed callbacks
+        are registered for clientinfo fields the clientlist lacks, the clients are additionally updated with
+        clientinfo, at most every CLIENTINFO_FALLBACK_INTERVAL milliseconds.
+
+        @param event The event object containing data related to the sent query
+        @return None
+        """
+
+        if not event.args:
+            return
+        self._bulk_client_fields = set(event.args[0].keys())
+        self._clientUpdateStats["bulk_updates"] += 1
+
+        for record in event.args:
+            if record.get("client_type") != "0" or not self._dataManager.has_clid(record["clid"]):
+                continue
+            old_servergroups = self._dataManager.get_client_value(record["clid"], "client_servergroups", None, True)
+            self._dataManager.update_client(record["clid"], record, self._on_client_value_changed)
+            if record.get("client_servergroups") != old_servergroups and \
+                    self._apply_client_servergroups(record["clid"]):
+                self._update_client_db_accesslevel(record["clid"])
+
+        if not self._needs_clientinfo_fallback():
+            return
+        now = monotonic_time()
+        if self._lastClientinfoFallback is not None and \
+                now - self._lastClientinfoFallback < self.CLIENTINFO_FALLBACK_INTERVAL:
+            return
+        self._lastClientinfoFallback = now
+        self._clientUpdateStats["clientinfo_fallbacks"] += 1
+        for clid in self._dataManager.get_clients():
+            self._update_client(clid)
+
+    def _needs_clientinfo_fallback(self):
+        """!
+        @brief Returns whether a value changed callback watches a field which only clientinfo returns.
+
+        Fields neither the clientlist nor clientinfo return, e.g values set by plugins, are ignored.
+        Until the first clientinfo answer arrived, every field missing in the clientlist counts.
+
+        @return Boolean
+        """
+        for key in self._callbacksValueChanged:
+            if key in self._bulk_client_fields:
+                continue
+            if self._clientinfo_fields is None or key in self._clientinfo_fields:
+                return True
+        return False
+
+    def get_client_update_stats(self):
+        """!
+        @brief Returns how often the client data was refreshed with a bulk clientlist, how often all clients
+        were additionally updated with clientinfo because of a value changed callback, and the number of
+        clientinfo updates sent in total.
+
+        @return Dictionary
+        """
+        return dict(self._clientUpdateStats)
+
     def _update_client(self, clid):
         """!
         @brief Updates a single client. Calls _update_client_callback as a callback.
@@ -586,7 +1051,9 @@ class TeamspeakBot:
         @return None
         """
 
-        self.send_command("clientinfo clid=%s" % str(clid), self._update_client_callback, {"clid": int(clid)})
+        self._clientUpdateStats["clientinfo_queries"] += 1
+        self.send_command("clientinfo clid=%s" % str(clid), self._update_client_callback, {"clid": int(clid)},
+                          priority=CommandPriority.BACKGROUND)
 
     def _update_client_callback(self, event):
         """!
@@ -598,6 +1065,8 @@ class TeamspeakBot:
         @return None
         """
 
+        if self._clientinfo_fields is None:
+            self._clientinfo_fields = set(event.args[0].keys())
         self._dataManager.update_client(event.data["clid"], event.args[0], self._on_client_value_changed)
 
     def _on_client_value_changed(self, clid, key, old_value, value):
@@ -618,7 +1087,7 @@ class TeamspeakBot:
 
     def _update_all_client_db_accesslevel(self):
         """!
-        @brief Updates all accesslevels in the db
+        @brief Updates all accesslevels in the db which changed since they were last written
 
         @return None
         """
@@ -628,7 +1097,7 @@ class TeamspeakBot:
 
     def _update_client_db_accesslevel(self, clid):
         """!
-        @brief Updates the accesslevel for the given client in the database
+        @brief Updates the accesslevel for the given client in the database, if it changed
 
         @param clid Client for which to update the accesslevel
         @return None
@@ -671,7 +1140,7 @@ class TeamspeakBot:
         if cldbid is None:
             return
         self.send_command("servergroupsbyclientid cldbid=%s" % str(cldbid), self._update_client_servergroups_callback,
-                          data=clid)
+                          data=clid, priority=CommandPriority.BACKGROUND)
 
     def _update_client_servergroups_callback(self, event):
         """!
@@ -682,6 +1151,110 @@ class TeamspeakBot:
         """
 
         self._dataManager.add_client_servergroups(event.data, event.args, True)
+        self._update_client_db_accesslevel(event.data)
+
+    def _update_servergroup_list(self):
+        """!
+        @brief Periodically refreshes the sgid -> name cache used in bulk mode.
+
+        @return None
+        """
+
+        self._missingServergroups.clear()
+        self._request_servergroup_list()
+
+    def _request_servergroup_list(self):
+        """!
+        @brief Requests the servergrouplist unless it is already pending.
+
+        @return None
+        """
+
+        if self._servergroupListPending:
+            return
+        self._servergroupListPending = True
+        self.send_command("servergrouplist", self._on_servergrouplist, err_callback=self._on_servergrouplist_error,
+                          priority=CommandPriority.BACKGROUND)
+
+    def _on_servergrouplist(self, event):
+        """!
+        @brief Refreshes the sgid -> name cache and reapplies the servergroups of all clients.
+
+        @param event The event object containing data related to the sent query
+        @return None
+        """
+
+        self._servergroupListPending = False
+        servergroup_names = {int(servergroup["sgid"]): servergroup["name"] for servergroup in event.args}
+        names_changed = servergroup_names != self._servergroupNames
+        self._servergroupNames = servergroup_names
+        for clid in self._dataManager.get_clients():
+            if self._apply_client_servergroups(clid, names_changed):
+                self._update_client_db_accesslevel(clid)
+
+    def _on_servergrouplist_error(self, event):
+        """!
+        @brief Allows the servergrouplist to be requested again after it failed.
+
+        @param event The event object containing data related to the sent query
+        @return None
+        """
+
+        self._servergroupListPending = False
+
+    def _apply_client_servergroups(self, clid, force=False):
+        """!
+        @brief Sets the servergroups of a client from its client_servergroups field.
+
+        Requests a new servergrouplist when the client is in a servergroup which is not cached yet.
+
+        @param clid The client whose servergroups to set
+        @param force Whether the servergroups should be rebuilt even when their ids did not change,
+        used after the servergroup names changed
+        @return True if the servergroups of the client changed
+        """
+
+        if not self._servergroupNames:
+            return False
+        field = self._dataManager.get_client_value(clid, "client_servergroups", None, True)
+        if field is None:
+            return False
+        sgids = set(int(sgid) for sgid in field.split(",") if sgid)
+        for sgid in sgids:
+            if sgid not in self._servergroupNames and sgid not in self._missingServergroups:
+                self._missingServergroups.add(sgid)
+                self._request_servergroup_list()
+        if force:
+            self._dataManager.set_client_servergroups(clid, set(), self._servergroupNames)
+        return self._dataManager.set_client_servergroups(clid, sgids, self._servergroupNames)
+
+    def _check_query_timeouts(self):
+        """!
+        @brief Calls the error callbacks of queries which timed out and resyncs stalled connections.
+
+        @return None
+        """
+
+        for query in self._queryTracker.check_timeouts():
+            if query.errCallback:
+                query.errCallback(Event([{"id": "-1", "msg": "query timed out"}], query.data))
+
+        if self._query_timeout and \
+                self._queryTracker.get_oldest_query_age() > self._query_timeout * self.QUERY_STALL_FACTOR:
+            self._resync("no answer for {0} ms".format(int(self._queryTracker.get_oldest_query_age())))
+
+    def _resync(self, reason):
+        """!
+        @brief Drops the connection when the answers can not be matched to the queries anymore.
+
+        Reconnecting resets the query tracker and reinitializes all data.
+
+        @param reason Why the connection is out of sync
+        @return None
+        """
+
+        print("Query answers are out of sync ({0}), reconnecting".format(reason))
+        self._call_callbacks(None, EventTypes.LOST_CONNECTION)
 
     def _send_heartbeat(self):
         """
@@ -689,9 +1262,10 @@ class TeamspeakBot:
 
         @return None
         """
-        self.send_command("whoami")
+        self.send_command("whoami", priority=CommandPriority.BACKGROUND)
 
-    def send_command(self, message, callback=None, data=None, err_callback=None):
+    def send_command(self, message, callback=None, data=None, err_callback=None, timeout=None,
+                     priority=CommandPriority.NORMAL):
         """!
         @brief Sends a raw message to the teamspeak servers.
 
@@ -703,20 +1277,109 @@ class TeamspeakBot:
         @param callback The callback which will be called when the answer for the query arrives
         @param data Additional data which will be passed to the callback as event.data
         @param err_callback A callback which will be called when the query failed
+        @param timeout Milliseconds after which err_callback is called with error id -1 when no answer arrived.
+            Defaults to the query_timeout config value. Queries which can not be sent because the connection
+            was lost are failed with error id -1 as well.
+        @param priority A CommandPriority. Commands are queued when the serverquery flood limit is configured
+            and reached. Queued commands with a higher priority are sent first.
+        @return Boolean. True if the message was sent or queued, false otherwise.
+        """
+        return self._schedule_query(Bot.QueryManager.Query(callback, data, message, err_callback), timeout, priority)
+
+    def query(self, message, data=None, timeout=None, priority=CommandPriority.NORMAL):
+        """!
+        @brief Sends a raw message to the teamspeak server and returns an awaitable future.
+
+        The future resolves with the received records, in the same format as event.args. When the
+        server answers with an error, the future raises a QueryError, when no answer arrives in time a
+        QueryTimeoutError and when the bot is not connected a ConnectionError. Many queries can be awaited
+        concurrently, e.g with asyncio.gather. This is the awaitable counterpart of send_command:
+
+        ```
+            async def on_client_joined(self, event):
+                info = await self.bot_instance.query("clientinfo clid=%s" % event.args[0]["clid"])
+        ```
+
+        @param message The message to send
+        @param data Additional data which will be passed to callbacks of the query
+        @param timeout Milliseconds after which the query times out. Defaults to the query_timeout config value.
+        @param priority A CommandPriority, see send_command
+        @return asyncio.Future
+        """
+        future = self._reactor.loop.create_future()
+        if not self._schedule_query(Bot.QueryManager.Query(None, data, message, None, future), timeout, priority):
+            future.set_exception(ConnectionError("Not connected to the teamspeak server"))
+        return future
+
+    def _schedule_query(self, query, timeout, priority):
+        """!
+        @brief Hands the query to the command scheduler, which sends it as soon as the flood limit allows.
+
+        @param query The query to send
+        @param timeout Milliseconds after which the query times out, None for the configured default
+        @param priority A CommandPriority
+        @return Boolean. False when not connected, true otherwise.
+        """
+        if not self._conn.is_connected():
+            return False
+
+        self._commandScheduler.schedule(query, priority, timeout)
+        return True
+
+    def _send_query(self, query, timeout=None):
+        """!
+        @brief Tracks the given query and writes it to the socket.
+
+        @param query The query to send
+        @param timeout Milliseconds after which the query times out, None for the configured default
         @return Boolean. True if the message was sent, false otherwise.
         """
         if not self._conn.is_connected():
             return False
 
-        query = Bot.QueryManager.Query(callback, data, message, err_callback)
-        self._queryTracker.add_query(query)
+        if timeout is None:
+            timeout = self._query_timeout
+        self._queryTracker.add_query(query, timeout or None)
         try:
-            self._conn.send_message(message + "\n\r")
+            self._conn.send_message(query.text + "\n\r")
             return True
         except socket.error:
             self._call_callbacks(None, EventTypes.LOST_CONNECTION)
             return False
 
+    def _on_query_not_sent(self, query):
+        """!
+        @brief Fails a query the scheduler could not send because the connection is gone. Its future raises a
+        ConnectionError and its error callback is called with error id -1, like for a timeout.
+
+        @param query The query
+        @return None
+        """
+        query.fail(ConnectionError("Not connected to the teamspeak server"))
+        if query.errCallback:
+            query.errCallback(Event([{"id": "-1", "msg": "not connected"}], query.data))
+
+    def create_task(self, coroutine):
+        """!
+        @brief Runs a coroutine on the bots event loop.
+
+        Plugin callbacks and chat command callbacks which are coroutines are scheduled through
+        this function automatically. Exceptions raised by the coroutine are printed.
+
+        @param coroutine The coroutine to run
+        @return asyncio.Task
+        """
+        task = self._reactor.loop.create_task(coroutine)
+        task.add_done_callback(self._on_task_done)
+        return task
+
+    @staticmethod
+    def _on_task_done(task):
+        if task.cancelled() or task.exception() is None:
+            return
+        exception = task.exception()
+        traceback.print_exception(type(exception), exception, exception.__traceback__)
+
     def _intialize_data(self):
         """!
         @brief Initializes the clientlist.
@@ -765,64 +1428,170 @@ class TeamspeakBot:
 
         self._set_bot_name()
         self._dataManager.add_channels(event.args)
-        self._update_all_client_servergroups()
+        if self._bulk_client_updates:
+            self._request_servergroup_list()
+        else:
+            self._update_all_client_servergroups()
         self._call_method_on_all_plugins("on_initial_data", event.data, event.args)
 
     def _on_initial_server_servergroups(self):
         pass
 
     # everything for slaves ( receiving channel messages ) here
+    def _on_channel_occupancy_changed(self, cid, occupied):
+        """!
+        @brief Adds a slave to a channel which became occupied and removes the slave of a channel which became empty.
+
+        The slave of an empty channel is removed after the channel_slaves.release_delay config value, unless the
+        channel is occupied again in the meantime.
+
+        @param cid The channel id
+        @param occupied True when the first client entered the channel, False when the last client left it
+        @return None
+        """
+        if occupied:
+            release_timer = self._slaveReleaseTimers.pop(cid, None)
+            if release_timer is not None:
+                self._timer.remove_timer(release_timer)
+            self._add_slave(cid)
+        elif self._slaveReleaseDelay and cid in self._slaves:
+            if cid not in self._slaveReleaseTimers:
+                self._slaveReleaseTimers[cid] = self._timer.start_timer(self._release_slave, self._slaveReleaseDelay,
+                                                                        True, cid)
+        else:
+            self._remove_slave(cid)
+
+    def _release_slave(self, cid):
+        del self._slaveReleaseTimers[cid]
+        self._remove_slave(cid)
+
     def _update_slaves(self):
         """!
         Will initiate new slaves and delete the slaves sitting in empty channels. All those slaves
         are used to relay channel text messages to the main bot in order to fire events.
 
+        Slaves are added and removed by _on_channel_occupancy_changed, this only reconciles them with the
+        channels which are occupied.
+
         @return None
         """
-        channels_with_clients = set(
-            [int(self._dataManager.get_client_value(clid, "cid", None, True)) for clid in
-             self._dataManager.get_clients()]
-        )
+        # slaves are removed first, so that a client hopping channels reuses the slave of its old channel
+        for cid in dict(self._slaves):
+            if cid not in self._slaveReleaseTimers and not self._dataManager.get_channel_client_count(cid):
+                self._remove_slave(cid)
+        channels_with_clients = self._dataManager.get_occupied_channels()
         for cid in channels_with_clients:
             if cid not in self._slaves:
                 self._add_slave(cid)
-        for cid in dict(self._slaves):
-            if cid not in channels_with_clients:
-                self._remove_slave(cid)
 
     def _add_slave(self, cid):
         """!
         Adds a slave to the given channel. If a slave already exists this will do nothing.
 
+        An idle slave is moved into the channel when there is one, a new slave is only connected otherwise.
+
         @param cid The channel id to which the slave will join.
         @return None
         """
         if cid in self._slaves:
             return
+
+        # the most recently released slave is reused, so that the longest idle ones run into the idle timeout
+        while self._idleSlaves:
+            slave, _ = self._idleSlaves.pop()
+            if not slave.is_connected():
+                slave.kill()
+                continue
+            slave.assign(cid)
+            self._slaves[cid] = slave
+            self._slavePoolStats["reused"] += 1
+            return
+
         self._slaves[cid] = BotChannelSlave(self._ip, self._port, self._user, self._password,
-                                            self._virtualServerId, cid, self._on_channel_text)
+                                            self._virtualServerId, cid, self._on_channel_text, self._reactor,
+                                            self._on_slave_connect_attempt, self._timer, self._slaveParkingChannel)
+        self._slavePoolStats["created"] += 1
+
+    def _on_slave_connect_attempt(self, latency, error):
+        """!
+        @brief Records the outcome of a connection attempt of a slave.
+
+        @param latency Milliseconds the attempt took
+        @param error The exception when the attempt failed, None otherwise
+        @return None
+        """
+        if error is not None:
+            self._slavePoolStats["connect_failures"] += 1
+            return
+        self._slavePoolStats["connects"] += 1
+        self._slavePoolStats["connect_latency_total"] += latency
+        self._slavePoolStats["connect_latency_max"] = max(self._slavePoolStats["connect_latency_max"], latency)
 
     def _remove_slave(self, cid):
         """!
         Removes the slave from the given channel. If that channel has no slave this will do nothing.
 
+        The slave stays connected in the idle pool unless the pool is full. An idle slave leaves the channel
+        for its parking channel, so that the empty channel can be deleted.
+
         @param cid The channel id from which the slave should be removed.
         @return None
         """
+        release_timer = self._slaveReleaseTimers.pop(cid, None)
+        if release_timer is not None:
+            self._timer.remove_timer(release_timer)
         if cid not in self._slaves:
             return
 
-        self._slaves[cid].kill()
-        del self._slaves[cid]
+        slave = self._slaves.pop(cid)
+        if len(self._idleSlaves) < self._slavePoolSize and slave.is_connected():
+            slave.release()
+            self._idleSlaves.append((slave, monotonic_time()))
+        else:
+            slave.kill()
+
+    def _evict_idle_slaves(self):
+        """!
+        @brief Disconnects the slaves which were idle for longer than the channel_slaves.idle_timeout config value.
+
+        @return None
+        """
+        now = monotonic_time()
+        while self._idleSlaves and now - self._idleSlaves[0][1] >= self._slaveIdleTimeout:
+            slave, _ = self._idleSlaves.pop(0)
+            slave.kill()
+            self._slavePoolStats["evicted"] += 1
 
     def _remove_all_slaves(self):
         """
-        @brief Disconnects and removes all slaves
+        @brief Disconnects and removes all slaves, including the idle ones
 
         @return None
         """
-        for cid in dict(self._slaves):
-            self._remove_slave(cid)
+        for release_timer in self._slaveReleaseTimers.values():
+            self._timer.remove_timer(release_timer)
+        self._slaveReleaseTimers.clear()
+        for cid in list(self._slaves):
+            self._slaves.pop(cid).kill()
+        for slave, _ in self._idleSlaves:
+            slave.kill()
+        self._idleSlaves = []
+
+    def get_slave_pool_stats(self):
+        """!
+        @brief Returns the number of active and idle channel slaves, and how many slaves were created,
+        reused from the idle pool and disconnected for being idle too long.
+
+        Also contains the number of successful and failed connection attempts of slaves and the time
+        a successful attempt took, in milliseconds.
+
+        @return Dictionary
+        """
+        stats = dict(self._slavePoolStats)
+        stats["active"] = len(self._slaves)
+        stats["idle"] = len(self._idleSlaves)
+        stats["connect_latency_avg"] = stats["connect_latency_total"] / stats["connects"] if stats["connects"] else 0
+        return stats
 
     # functions mainly intended for plugins
     def add_chat_command(self, command, description, access_level, callback, args=None, is_channel_command=False):
@@ -841,7 +1610,8 @@ class TeamspeakBot:
         @param command The command the user needs to type ( without prefix )
         @param description A description of that command. Usefull in for help commands and similiar
         @param access_level The minimum accesslevel required for the command.
-        @param callback A callback to call when a user triggers a command
+        @param callback A callback to call when a user triggers a command. Callbacks marked with offload
+                        run on the plugin thread pool.
         @param args An array of strings of args you expect. You have to parse them yourself, this is only to help the
                     user about expected arguments.
         @param is_channel_command Whether the command should trigger in channels or in private messages
@@ -852,6 +1622,10 @@ class TeamspeakBot:
             args = []
         if command in self._chatCommands:
             return False
+        if Bot.PluginExecutor.is_offloaded(callback):
+            callback = self._offload(callback, self._chatCommandMetric, command)
+        elif self._timeCallbacks:
+            callback = self._time_callback(callback, self._chatCommandMetric, command)
 
         self._chatCommands[command.lower()] = ChatCommand(command, description, int(access_level), callback,
                                                           args,
@@ -938,6 +1712,24 @@ class TeamspeakBot:
         """
         return self._dataManager.get_clients()
 
+    def get_clients_in_channel(self, cid):
+        """!
+        @brief Returns an array of client ids which are in the given channel. This excludes server query clients.
+
+        @param cid The channel id
+        @return Array of integers
+        """
+        return self._dataManager.get_clients_in_channel(cid)
+
+    def get_clients_in_servergroup(self, sgid):
+        """!
+        @brief Returns an array of currently connected client ids which are in the given servergroup.
+
+        @param sgid The servergroup id
+        @return Array of integers
+        """
+        return self._dataManager.get_clients_in_servergroup(sgid)
+
     def get_clients_cldbid(self):
         """!
         @brief Returns an array of currently connected client database ids. This excludes server query clients.
@@ -1052,6 +1844,15 @@ class TeamspeakBot:
         """
         return self._dataManager.get_client_cldbid_by_clid(clid)
 
+    def get_client_cid_by_clid(self, clid):
+        """!
+        @brief Returns the id of the channel the given client is in.
+
+        @param clid The client id
+        @return The channel id as integer or none
+        """
+        return self._dataManager.get_client_cid_by_clid(clid)
+
     def get_client_clid_by_cldbid(self, cldbid):
         """!
         @brief Returns the client id which belongs to the given client database id.
@@ -1061,6 +1862,15 @@ class TeamspeakBot:
         """
         return self._dataManager.get_client_clid_by_cldbid(cldbid)
 
+    def get_client_clid_by_uid(self, uid):
+        """!
+        @brief Returns the client id which belongs to the given unique identifier.
+
+        @param uid The client unique identifier
+        @return The client id or none
+        """
+        return self._dataManager.get_client_clid_by_uid(uid)
+
     def get_client_accesslevel(self, clid):
         """!
         @brief Returns the client accesslevel for the given client id.
@@ -1070,27 +1880,158 @@ class TeamspeakBot:
         """
         return self._dataManager.get_access_level_by_clid(clid)
 
+    def get_command_queue_stats(self):
+        """!
+        @brief Returns statistics about the outgoing command queue.
+
+        Per priority ( interactive, normal, background ) the number of queued and sent commands
+        as well as the average and maximum time in milliseconds commands waited in the queue.
+        "coalesced" counts background commands which were dropped, as an identical one was already queued.
+
+        @return Dictionary
+        """
+        return self._commandScheduler.get_stats()
+
+    def get_in_flight_query_count(self):
+        """!
+        @brief Returns the number of sent queries which are still waiting for their answer.
+
+        @return Integer
+        """
+        return self._queryTracker.get_in_flight_count()
+
     def get_mysql_instance(self):
         """!
-        @brief Returns a handle to the mysql instance to perform raw queries.
+        @brief Returns a handle to the storage manager to perform raw queries.
 
-        @return MysqlClass
+        Depending on the storage config this is a MysqlManager or a SqliteManager.
+
+        @return StorageManager
         """
-        return self._mysqlManager
+        return self._storageManager
 
     def execute_query(self, query, *args):
         """!
-        @brief Executes a raw query on the mysql database.
+        @brief Executes a raw query on the database.
 
-        We are using pymysql with a dict cursor in the backend. Refer to the
+        With the mysql storage we are using pymysql with a dict cursor in the backend. Refer to the
         pymysql documentation for more information: http://pymysql.readthedocs.io/en/latest/modules/cursors.html
-        This function wraps "execute" and the args will be passed on.
+        With the sqlite storage a sqlite3 cursor is returned, whose rows are dictionaries as well.
+        This function wraps "execute" and the args will be passed on. Use %s placeholders for both storages.
+
+        Pending writes of the write behind buffer are flushed first, after the database thread wrote the
+        batches it was given, so the query sees them.
+        The query blocks the bot until it finished, prefer execute_query_async.
 
         @param query:
         @param args A
         @return The cursor object
         """
-        return self._mysqlManager.execute_query(query, *args)
+        self._storageManager.flush(False)
+        return self._storageManager.execute_query(query, *args)
+
+    def execute_query_async(self, query, *args, callback=None):
+        """!
+        @brief Executes a raw query on a separate database thread without blocking the bot.
+
+        The thread has its own database connection and executes the queries in the order they were sent.
+        The returned future can be awaited from coroutines, alternatively a callback can be given which is
+        called on the bots thread with the list of rows once the query finished. Errors are printed in that case.
+
+            rows = await self.bot_instance.execute_query_async("SELECT * FROM Settings WHERE `key`=%s", "motd")
+
+        @param query The query, with %s placeholders for args
+        @param args The query parameters
+        @param callback Optional callback receiving the list of rows, each row being a dictionary
+        @return asyncio.Future which resolves to the list of rows
+        """
+        self._storageManager.flush()
+        future = self._get_database_executor().execute_query(query, *args)
+        if callback is not None:
+            future.add_done_callback(functools.partial(self._on_query_async_done, callback))
+        return future
+
+    @staticmethod
+    def _on_query_async_done(callback, future):
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
+            return
+        callback(future.result())
+
+    def _get_database_executor(self):
+        """!
+        @brief Returns the database executor, starting it on first use.
+
+        @return DatabaseExecutor
+        """
+        if self._databaseExecutor is None:
+            self._databaseExecutor = Bot.DatabaseExecutor.DatabaseExecutor(
+                self._create_storage_manager, self._reactor.loop,
+                functools.partial(self._observe_database_latency, "executor"))
+        return self._databaseExecutor
+
+    @staticmethod
+    def _get_storage_backend():
+        """!
+        @brief Returns the configured storage backend, either mysql or sqlite.
+
+        @return String
+        """
+        return config.get_value("storage") or "mysql"
+
+    @staticmethod
+    def _create_storage_manager():
+        """!
+        @brief Creates and connects the configured storage backend. Also used to create the connection
+        of the database executor on its thread.
+
+        The backend modules are imported here, so that pymysql is only needed with the mysql storage.
+
+        @return StorageManager
+        """
+        if TeamspeakBot._get_storage_backend() == "sqlite":
+            import Bot.SqliteManager
+            storage_manager = Bot.SqliteManager.SqliteManager()
+            storage_manager.connect_to_db(config.get_value("sqlite.path") or "ts3bot.sqlite")
+            return storage_manager
+
+        import Bot.MysqlManager
+        storage_manager = Bot.MysqlManager.MysqlManager()
+        storage_manager.connect_to_db(config.get_value("mysql.host"),
+                                      config.get_value("mysql.port"),
+                                      config.get_value("mysql.user"),
+                                      config.get_value("mysql.password"),
+                                      config.get_value("mysql.db"))
+        return storage_manager
+
+    def get_database_cache_stats(self):
+        """!
+        @brief Returns the counters of the ClientSettings and Settings caches, see StorageManager.get_cache_stats.
+
+        @return Dictionary or None when the cache is disabled
+        """
+        return self._storageManager.get_cache_stats()
+
+    def get_database_executor_stats(self):
+        """!
+        @brief Returns the counters of the database executor, see DatabaseExecutor.get_stats.
+
+        @return Dictionary or None when the executor was not used yet
+        """
+        if self._databaseExecutor is None:
+            return None
+        return self._databaseExecutor.get_stats()
+
+    def get_write_behind_stats(self):
+        """!
+        @brief Returns the counters of the database write behind buffer, see StorageManager.get_write_behind_stats.
+
+        @return Dictionary
+        """
+        return self._storageManager.get_write_behind_stats()
 
     # simple server query wrappers starting from here
     def send_server_notify_register(self, event, idd=None):
@@ -1107,14 +2048,15 @@ class TeamspeakBot:
         else:
             self.send_command("servernotifyregister event=" + event)
 
-    def switch_to_channel(self, cid):
+    def switch_to_channel(self, cid, priority=CommandPriority.NORMAL):
         """!
         @brief Switches the bot instance to the given channel id
 
         @param cid The channel id the bot should switch into
+        @param priority A CommandPriority, see send_command
         @return None
         """
-        self.send_command("clientmove clid=%s cid=%s" % (self._my_clid, cid))
+        self.send_command("clientmove clid=%s cid=%s" % (self._my_clid, cid), priority=priority)
 
     def switch_client_to_channel(self, clid, cid):
         """!
@@ -1171,7 +2113,7 @@ class TeamspeakBot:
         """
         self.send_command("sendtextmessage targetmode=1 target={0} msg={1}".format(
             clid, escape(message)
-        ), callback, data, err_callback)
+        ), callback, data, err_callback, priority=CommandPriority.INTERACTIVE)
 
     def send_text_to_channel(self, cid, message):
         """!
@@ -1181,10 +2123,10 @@ class TeamspeakBot:
         @param msg Message to send
         @return None
         """
-        self.switch_to_channel(cid)
+        self.switch_to_channel(cid, CommandPriority.INTERACTIVE)
         self.send_command("sendtextmessage targetmode=2 target={0} msg={1}".format(
             cid, escape(message)
-        ))
+        ), priority=CommandPriority.INTERACTIVE)
 
     # more complex server query wrappers encapsulating multiple commands into one function
     def login_use(self, register_for_events=True):
@@ -1219,31 +2161,173 @@ class TeamspeakBot:
 
 
 class BotChannelSlave(TeamspeakBot):
+    """!
+    @brief A minimal bot which sits in a channel and relays its text messages to the main bot.
+
+    Slaves connect in the background, so creating one never blocks the main bot. Failed connection attempts
+    are retried with an exponential backoff. A slave shares the reactor and the timer of the main bot and is
+    only called when its connection received data or one of its timers is due.
+    """
+
+    # Error id the server answers with when the client already is in the target channel
+    ALREADY_IN_CHANNEL_ERROR_ID = 770
+    # Milliseconds after which a connection attempt is aborted
+    CONNECT_TIMEOUT = 10000
+    # Milliseconds to wait after the first failed connection attempt, doubled after every further failure
+    CONNECT_RETRY_DELAY = 1000
+    CONNECT_RETRY_MAX_DELAY = 30000
+
     def __init__(self, ip, port=10011, user=None, password=None,
-                 virtual_server_id=None, cid=None, channel_text_callback=None):
-        super().__init__(ip, port, user, password, virtual_server_id, minimal=True)
+                 virtual_server_id=None, cid=None, channel_text_callback=None, reactor=None, connect_callback=None,
+                 timer=None, parking_cid=None):
+        """!
+        @brief Creates the slave and starts connecting it.
 
-        success = self.connect()
+        @param cid The channel the slave moves into once it is logged in
+        @param channel_text_callback Called with the event of every text message in that channel
+        @param connect_callback Called with the duration in milliseconds and the exception, None on success,
+            after every connection attempt
+        @param timer The Timer of the main bot
+        @param parking_cid The channel the slave waits in while it is released. Defaults to the channel it was in
+            after logging in, the default channel of the server
+        """
+        super().__init__(ip, port, user, password, virtual_server_id, minimal=True, reactor=reactor, timer=timer)
 
-        if not success:
-            print("A slave had trouble to connect")
-            exit()
+        # the channel the slave is supposed to be in, and the channel it is confirmed to be in
+        self._target_cid = cid
+        self._cid = None
+        self._parking_cid = parking_cid
+        self._home_cid = None
+        self._channel_text_callback = channel_text_callback
+        self._connect_callback = connect_callback
+        self._connectTask = None
+        self._flushTimer = None
 
-        self.login_use(register_for_events=False)
+        self.connect()
 
-        self._target_cid = cid
+    def _init_networking(self, ip, port):
+        self._conn = Network.TCPConnection(ip, port, self._reactor, self._process_messages)
+
+    def connect(self):
+        """!
+        @brief Starts connecting and logging in in the background, unless that is already in progress.
+
+        @return False, the slave is never connected when this returns
+        """
+        if self._connectTask is None or self._connectTask.done():
+            self._connectTask = self.create_task(self._connect_with_retry())
+        return False
+
+    async def _connect_with_retry(self):
+        delay = self.CONNECT_RETRY_DELAY
+        while True:
+            start = monotonic_time()
+            try:
+                await self._conn.connect_async(self.CONNECT_TIMEOUT / 1000)
+            except (OSError, asyncio.TimeoutError) as e:
+                print("A slave had trouble to connect: {0!r}, retrying in {1} ms".format(e, delay))
+                if self._connect_callback is not None:
+                    self._connect_callback(monotonic_time() - start, e)
+                await asyncio.sleep(delay / 1000)
+                delay = min(delay * 2, self.CONNECT_RETRY_MAX_DELAY)
+                continue
+            if self._connect_callback is not None:
+                self._connect_callback(monotonic_time() - start, None)
+            self._commandScheduler.reset()
+            self.login_use()
+            return
+
+    def _on_connection_lost(self):
+        super()._on_connection_lost()
+        self.connect()
+
+    def _schedule_query(self, query, timeout, priority):
+        scheduled = super()._schedule_query(query, timeout, priority)
+        self._start_flush_timer()
+        return scheduled
+
+    def _start_flush_timer(self):
+        """!
+        @brief Flushes the command queue once the flood limit allows it, as the slave is not processed every tick.
 
+        @return None
+        """
+        if self._flushTimer is not None:
+            return
+        time_until_next_send = self._commandScheduler.get_time_until_next_send()
+        if time_until_next_send is not None:
+            self._flushTimer = self._timer.start_timer(self._flush_commands, time_until_next_send, True)
+
+    def _flush_commands(self):
+        self._flushTimer = None
+        self._commandScheduler.flush()
+        self._start_flush_timer()
+
+    def login_use(self, register_for_events=False):
+        super().login_use(register_for_events=False)
         self.send_server_notify_register("textchannel")
-        self._channel_text_callback = channel_text_callback
-        self._cid = cid
 
     def _on_initial_whoami(self, event):
         self._my_clid = event.args[0]["client_id"]
-        self.switch_to_channel(self._target_cid)
+        self._home_cid = event.args[0].get("client_channel_id")
+        self._cid = None
+        if self._target_cid is not None:
+            self._move_to_target()
+
+    def assign(self, cid):
+        """!
+        @brief Moves the slave into the given channel. Text messages of that channel are relayed
+        once the move succeeded.
+
+        @param cid The channel id
+        @return None
+        """
+        self._target_cid = cid
+        self._cid = None
+        if self._my_clid is not None:
+            self._move_to_target()
+
+    def release(self):
+        """!
+        @brief Stops relaying text messages and moves the slave to its parking channel, so that it does not keep
+        an empty channel alive. The slave stays connected and can be assigned to another channel.
+
+        @return None
+        """
+        self._target_cid = None
+        self._cid = None
+        parking_cid = self._parking_cid if self._parking_cid is not None else self._home_cid
+        if self._my_clid is not None and parking_cid is not None:
+            self.send_command("clientmove clid=%s cid=%s" % (self._my_clid, parking_cid),
+                              data=parking_cid, err_callback=self._on_parked)
+
+    def _move_to_target(self):
+        self.send_command("clientmove clid=%s cid=%s" % (self._my_clid, self._target_cid),
+                          data=self._target_cid, err_callback=self._on_moved)
+
+    def _on_moved(self, event):
+        error_id = int(event.args[0]["id"])
+        if event.data == self._target_cid and error_id in (0, self.ALREADY_IN_CHANNEL_ERROR_ID):
+            self._cid = self._target_cid
+
+    @staticmethod
+    def _on_parked(event):
+        error_id = int(event.args[0]["id"])
+        if error_id not in (0, BotChannelSlave.ALREADY_IN_CHANNEL_ERROR_ID):
+            print("A released slave could not move to its parking channel {0}: {1}".format(
+                event.data, event.args[0].get("msg", "")))
 
     def _on_text(self, event):
+        if self._cid is None:
+            return
         event.args[0]["cid"] = self._cid
         self._channel_text_callback(event)
 
     def kill(self):
+        if self._connectTask is not None:
+            self._connectTask.cancel()
+        for timer_id in (self._heartbeatTimer, self._queryTimeoutTimer, self._flushTimer):
+            if timer_id is not None:
+                self._timer.remove_timer(timer_id)
+        self._flushTimer = None
         self.disconnect()
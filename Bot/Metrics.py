@@ -0,0 +1,242 @@
+# coding=utf-8
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _format_labels(label_names, label_values, extra_name=None, extra_value=None):
+    labels = ['{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+              for name, value in zip(label_names, label_values)]
+    if extra_name is not None:
+        labels.append('{0}="{1}"'.format(extra_name, extra_value))
+    if not labels:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+class Metric(ABC):
+    """!
+    @brief Base of all metrics. A metric has a series of samples per combination of label values.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+
+    def render(self):
+        """!
+        @brief Returns the metric in the Prometheus text format.
+
+        @return List of lines
+        """
+        lines = ["# HELP {0} {1}".format(self.name, self.help_text), "# TYPE {0} {1}".format(self.name, self.TYPE)]
+        lines.extend(self._render_samples())
+        return lines
+
+    @abstractmethod
+    def _render_samples(self):
+        pass
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _render_samples(self):
+        return ["{0}{1} {2}".format(self.name, _format_labels(self.label_names, label_values), _format_value(value))
+                for label_values, value in self._values.items()]
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        """!
+        @param function Optional. Called on every export. Returns the value, or a dictionary of label value
+            tuples to values when the gauge has labels.
+        """
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+        self._function = function
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def _render_samples(self):
+        values = self._values
+        if self._function is not None:
+            values = self._function()
+            if not self.label_names:
+                values = {(): values}
+        return ["{0}{1} {2}".format(self.name, _format_labels(self.label_names, label_values), _format_value(value))
+                for label_values, value in values.items()]
+
+
+class Histogram(Metric):
+    """!
+    @brief Counts observations in buckets. Only the bucket an observation falls into is counted, the
+    cumulative counts Prometheus expects are computed on export.
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self._buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts with a last +Inf bucket, sum]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self._buckets) + 1), 0.0]
+        series[0][bisect_left(self._buckets, value)] += 1
+        series[1] += value
+
+    def _render_samples(self):
+        lines = []
+        for label_values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{0}_bucket{1} {2}".format(
+                    self.name, _format_labels(self.label_names, label_values, "le", _format_value(bound)), cumulative))
+            labels = _format_labels(self.label_names, label_values)
+            lines.append("{0}_sum{1} {2}".format(self.name, labels, _format_value(total)))
+            lines.append("{0}_count{1} {2}".format(self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """!
+    @brief Holds all metrics of the bot and renders them in the Prometheus text format.
+
+    Metrics are not thread safe, record them on the bot thread only.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """!
+        @brief Adds a metric.
+
+        @param metric The metric
+        @return The metric
+        """
+        if metric.name in self._metrics:
+            raise ValueError("A metric named {0} is already registered".format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        return self.register(Gauge(name, help_text, label_names, function))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """!
+        @brief Returns all metrics in the Prometheus text format.
+
+        @return String
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """!
+    @brief Serves the metrics of a registry over HTTP, on a TCP port or a Unix socket.
+
+    The servers run on the event loop of the bot, so the registry is only read on the bot thread.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    PATH = b"/metrics"
+    # Seconds a client may take to send its request
+    REQUEST_TIMEOUT = 5
+
+    def __init__(self, registry, loop):
+        self._registry = registry
+        self._loop = loop
+        self._servers = []
+        self._unixSocketPath = None
+
+    def listen_tcp(self, host, port):
+        """!
+        @brief Starts serving on a TCP port. Must not be called while the event loop is running.
+
+        @param host The address to bind to
+        @param port The port
+        @return None
+        """
+        self._servers.append(self._loop.run_until_complete(asyncio.start_server(self._handle_request, host, port)))
+
+    def listen_unix(self, path):
+        """!
+        @brief Starts serving on a Unix socket, replacing an existing socket file. Must not be called while the
+        event loop is running.
+
+        @param path Path of the socket file
+        @return None
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        self._servers.append(self._loop.run_until_complete(asyncio.start_unix_server(self._handle_request, path)))
+        self._unixSocketPath = path
+
+    async def _handle_request(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+            while True:
+                header = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+                if header in (b"\r\n", b"\n", b""):
+                    break
+            request = request_line.split()
+            if len(request) < 2 or request[1].split(b"?")[0] != self.PATH:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            else:
+                body = self._registry.render().encode("utf-8")
+                writer.write("HTTP/1.0 200 OK\r\nContent-Type: {0}\r\nContent-Length: {1}\r\n\r\n".format(
+                    self.CONTENT_TYPE, len(body)).encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        if self._unixSocketPath is not None and os.path.exists(self._unixSocketPath):
+            os.remove(self._unixSocketPath)
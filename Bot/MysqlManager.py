@@ -1,9 +1,19 @@
 # coding=utf-8
 import pymysql
 
+from Bot.StorageManager import StorageManager, DatabaseConnectionError
+
+
+class MysqlManager(StorageManager):
+    UPSERT_ONLINE_CLIENT = ("INSERT INTO OnlineClients (`clid`, `cldbid`, `name`, `remote_ip`, `accesslevel`) "
+                            "VALUES (%s, %s, %s, %s, %s) "
+                            "ON DUPLICATE KEY UPDATE `cldbid`=VALUES(`cldbid`), `name`=VALUES(`name`), "
+                            "`remote_ip`=VALUES(`remote_ip`), `accesslevel`=VALUES(`accesslevel`)")
+    DatabaseError = pymysql.MySQLError
+    IntegrityError = pymysql.IntegrityError
 
-class MysqlManager:
     def __init__(self):
+        super().__init__()
         self._connection = None
         self._cur = None
         self._host = None
@@ -24,74 +34,30 @@ class MysqlManager:
             self._cur = self._connection.cursor()
         except pymysql.MySQLError as e:
             if e.args[0] == 2003:  # Could not connect to database
-                print(e.args[1])
-                exit()
-            else:
-                raise
+                raise DatabaseConnectionError(e.args[1]) from e
+            raise
 
-    def execute_query(self, sql_query, *args):
-        try:
-            self._cur.execute(sql_query, args)
-            return self._cur
-        except pymysql.MySQLError as e:
-            if e.args[0] in (2006, 2013):  # MYSQL GONE AWAY
-                self.connect_to_db(self._host, self._port, self._user, self._password, self._db)
-            elif e.args[0] in (1062,):  # DUPLICATE KEY ENTRY
-                pass
-            else:
-                raise
+    def _reconnect(self):
+        self.connect_to_db(self._host, self._port, self._user, self._password, self._db)
 
-    def add_online_client(self, clid, cldbid, name, remote_ip, accesslevel):
-        try:
-            self.execute_query("INSERT INTO OnlineClients (`clid`, `cldbid`, `name`, `remote_ip`, `accesslevel`) "
-                               "VALUES (%s, %s, %s, %s, %s);",
-                               str(clid), str(cldbid), str(name), str(remote_ip), accesslevel)
-            return True
-        except pymysql.IntegrityError:
-            return False
-
-    def set_client_accesslevel(self, clid, accesslevel):
-        self.execute_query("UPDATE OnlineClients set accesslevel=%s WHERE clid=%s;", accesslevel, clid)
-
-    def set_client_ip(self, clid, remote_ip):
-        self.execute_query("UPDATE OnlineClients set remote_ip=%s WHERE clid=%s;", remote_ip, clid)
-
-    def remove_online_client(self, clid):
-        try:
-            self.execute_query("DELETE FROM OnlineClients WHERE `clid` = %s", str(clid))
-            if self._cur.rowcount > 0:
-                return True
-            return False
-        except pymysql.IntegrityError:
-            return False
+    def _is_connection_lost(self, error):
+        return error.args[0] in (2006, 2013)  # MYSQL GONE AWAY
 
-    def clear_online_clients(self):
-        self.execute_query("DELETE FROM OnlineClients")
+    def _is_duplicate_key(self, error):
+        return error.args[0] in (1062,)  # DUPLICATE KEY ENTRY
 
-    def set_client_value(self, cldbid, key, value):
-        self.execute_query("REPLACE INTO ClientSettings (cldbid, `key`, value) VALUES (%s, %s, %s);",
-                           int(cldbid), str(key), value)
+    def _execute(self, sql_query, args):
+        self._cur.execute(sql_query, args)
+        return self._cur
 
-    def get_client_value(self, cldbid, key, default_value=None):
-        ret = self.execute_query("SELECT `value` "
-                                 "FROM ClientSettings "
-                                 "WHERE cldbid=%s AND `key`=%s", int(cldbid), str(key)).fetchone()
-        if ret is None:
-            return default_value
-        return ret["value"]
+    def _executemany(self, sql_query, args_list):
+        self._cur.executemany(sql_query, args_list)
 
-    def get_client_values(self, cldbid):
-        ret = self.execute_query("SELECT `key`, `value` FROM ClientSettings WHERE cldbid=%s", int(cldbid)).fetchall()
-        if not ret:
-            return {}
-        ret = {d["key"]: d["value"] for d in ret}
-        return ret
+    def _begin(self):
+        self._connection.begin()
 
-    def get_value(self, key, default_value=None):
-        ret = self.execute_query("SELECT `value` FROM Settings WHERE `key`=%s", key).fetchone()
-        if ret is None:
-            return default_value
-        return ret["value"]
+    def _commit(self):
+        self._connection.commit()
 
-    def set_value(self, key, value):
-        self.execute_query("REPLACE INTO Settings (`key`, value) VALUES (%s, %s);", key, value)
+    def _rollback(self):
+        self._connection.rollback()
@@ -0,0 +1,253 @@
+# coding=utf-8
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import threading
+from collections.abc import Mapping
+
+from Bot.Utility import monotonic_time, Event
+
+# Attribute offload sets on a function, holding its latency budget
+_OFFLOAD_ATTRIBUTE = "offload_budget"
+
+
+def offload(function=None, budget=None):
+    """!
+    @brief Marks a plugin hook or chat command callback to run on the plugin thread pool instead of the bot thread.
+
+    Use it for callbacks which block, e.g because they do HTTP requests or heavy computations. Can be used as
+    `@offload` or `@offload(budget=500)`. Calls to self.bot_instance made by the callback are executed on the
+    bot thread, the callback waits for their result.
+
+    @param function The callback, set when used without arguments
+    @param budget Milliseconds the callback may take before an overrun is logged. Defaults to the latency_budget
+        of the plugin.
+    @return The callback
+    """
+    def mark(marked_function):
+        if inspect.iscoroutinefunction(marked_function):
+            raise TypeError("{0} is a coroutine, it does not block the bot and needs no offload".format(
+                marked_function.__qualname__))
+        setattr(marked_function, _OFFLOAD_ATTRIBUTE, budget)
+        return marked_function
+
+    if function is not None:
+        return mark(function)
+    return mark
+
+
+def is_offloaded(function):
+    return hasattr(function, _OFFLOAD_ATTRIBUTE)
+
+
+def get_offload_budget(function):
+    return getattr(function, _OFFLOAD_ATTRIBUTE, None)
+
+
+def detach_event(event, bot):
+    """!
+    @brief Returns a copy of an event which can be handed to another thread.
+
+    The records are copied into plain dictionaries, as lazily parsed records must not be read from two
+    threads. event.Bot of the copy is set to the given bot, usually a BotProxy.
+
+    @param event The event
+    @param bot The bot the copy refers to
+    @return Event
+    """
+    copy = Event.__new__(Event)
+    copy.__dict__.update(event.__dict__)
+    if event.args:
+        copy.args = [dict(record) for record in event.args]
+    copy.Bot = bot
+    return copy
+
+
+def detach_argument(argument, bot):
+    """!
+    @brief Returns a copy of a callback argument which can be handed to another thread.
+
+    Events are copied with detach_event, lists of records, e.g the client and channel lists of
+    on_initial_data, are copied into lists of plain dictionaries. Other arguments are returned as they are.
+
+    @param argument The argument
+    @param bot The bot copied events refer to
+    @return The copy or the argument
+    """
+    if isinstance(argument, Event):
+        return detach_event(argument, bot)
+    if isinstance(argument, list):
+        return [dict(record) if isinstance(record, Mapping) else record for record in argument]
+    return argument
+
+
+class BotProxy:
+    """!
+    @brief Stands in for the bot in plugins with offloaded callbacks.
+
+    Methods called on the bot thread are called directly. Methods called from another thread are
+    executed on the event loop of the bot, the calling thread blocks until their result is available.
+    """
+
+    __slots__ = ("_bot", "_loop", "_executor", "_threadId")
+
+    # Seconds between two checks whether the bot is stopping while a call waits for the bot thread
+    CALL_POLL_INTERVAL = 0.5
+
+    def __init__(self, bot, loop, executor=None):
+        """!
+        @param bot The bot
+        @param loop The asyncio event loop of the bot
+        @param executor Optional. The PluginExecutor, waiting calls fail once it is shut down
+        """
+        self._bot = bot
+        self._loop = loop
+        self._executor = executor
+        self._threadId = threading.get_ident()
+
+    def __getattr__(self, name):
+        value = getattr(self._bot, name)
+        if not callable(value) or threading.get_ident() == self._threadId:
+            return value
+        return functools.partial(self._call_on_loop, value)
+
+    def _call_on_loop(self, function, *args, **kwargs):
+        future = concurrent.futures.Future()
+
+        def call():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._loop.call_soon_threadsafe(call)
+        while True:
+            try:
+                return future.result(self.CALL_POLL_INTERVAL)
+            except concurrent.futures.TimeoutError:
+                if self._executor is not None and self._executor.is_stopping() and future.cancel():
+                    raise RuntimeError("The bot is stopping, {0} was not called".format(function.__name__))
+
+
+class PluginExecutor:
+    """!
+    @brief Runs offloaded plugin callbacks on a bounded thread pool and keeps latency statistics per plugin.
+    """
+
+    def __init__(self, loop, max_workers, default_budget=None):
+        """!
+        @param loop The asyncio event loop of the bot
+        @param max_workers The maximum number of threads
+        @param default_budget Milliseconds a callback may take when neither the callback nor its plugin set a budget.
+            None disables the budget.
+        """
+        self._loop = loop
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._stopping = threading.Event()
+        self._defaultBudget = default_budget
+        self._stats = {}
+        self._pending = 0
+
+    def get_budget(self, owner, function):
+        """!
+        @brief Returns the latency budget of a callback: its own, the one of its plugin or the default.
+
+        @param owner The plugin the callback belongs to, None for plain functions
+        @param function The callback
+        @return Milliseconds or None
+        """
+        budget = get_offload_budget(function)
+        if budget is None:
+            budget = getattr(owner, "latency_budget", None)
+        if budget is None:
+            budget = self._defaultBudget
+        return budget
+
+    async def run(self, name, function, args, budget=None, observer=None):
+        """!
+        @brief Runs function(*args) on the thread pool.
+
+        @param name The name the statistics and overrun messages are kept under, usually the plugin class name
+        @param function The callback
+        @param args Arguments for the callback
+        @param budget Milliseconds the callback may take before an overrun is logged, None for no budget
+        @param observer Optional. Called on the bot thread with the execution time in milliseconds
+        @return The return value of the callback
+        """
+        self._pending += 1
+        try:
+            result, error, wait, duration = await asyncio.wrap_future(
+                self._pool.submit(self._timed_call, function, args, monotonic_time()), loop=self._loop)
+        finally:
+            self._pending -= 1
+
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {
+                "calls": 0,
+                "failed": 0,
+                "overruns": 0,
+                "time_total": 0,
+                "time_max": 0,
+                "wait_max": 0
+            }
+        stats["calls"] += 1
+        stats["time_total"] += duration
+        stats["time_max"] = max(stats["time_max"], duration)
+        stats["wait_max"] = max(stats["wait_max"], wait)
+        if observer is not None:
+            observer(duration)
+        if budget is not None and duration > budget:
+            stats["overruns"] += 1
+            print("{0}.{1} took {2:.0f} ms, its latency budget is {3} ms".format(
+                name, function.__name__, duration, budget))
+        if error is not None:
+            stats["failed"] += 1
+            raise error
+        return result
+
+    @staticmethod
+    def _timed_call(function, args, submitted_at):
+        start = monotonic_time()
+        result = None
+        error = None
+        try:
+            result = function(*args)
+        except Exception as e:
+            error = e
+        return result, error, start - submitted_at, monotonic_time() - start
+
+    def get_stats(self):
+        """!
+        @brief Returns the number of callbacks which were submitted but did not finish yet, and per plugin the
+        number of calls, failed calls and budget overruns as well as execution and maximum queue times in
+        milliseconds.
+
+        @return Dictionary
+        """
+        plugins = {}
+        for name, stats in self._stats.items():
+            plugin_stats = dict(stats)
+            plugin_stats["time_avg"] = stats["time_total"] / stats["calls"]
+            plugins[name] = plugin_stats
+        return {
+            "pending": self._pending,
+            "plugins": plugins
+        }
+
+    def is_stopping(self):
+        return self._stopping.is_set()
+
+    def shutdown(self, wait=False):
+        """!
+        @brief Stops the threads after all submitted callbacks finished. Calls of the callbacks to the bot
+        which are not executed yet fail from now on, as the bot thread no longer runs them.
+
+        @param wait Whether to block until the threads finished
+        @return None
+        """
+        self._stopping.set()
+        self._pool.shutdown(wait=wait)
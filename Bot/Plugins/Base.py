@@ -1,11 +1,16 @@
 from Bot.Main import CommandResults, TeamspeakBot
+from Bot.QueryManager import CommandPriority
+from Bot.PluginExecutor import offload
 
 
 class PluginBase:
     def __init__(self, bot_instance):
         self.bot_instance = bot_instance        # type: TeamspeakBot
         self.CommandResults = CommandResults
+        self.CommandPriority = CommandPriority
         self.order = 0
+        # Milliseconds an offloaded callback of this plugin may take before an overrun is logged, see offload
+        self.latency_budget = None
 
     def on_initial_data(self, client_list, channel_list):
         pass
@@ -1,11 +1,90 @@
 # coding=utf-8
+from collections import deque
+from enum import Enum
+
+from Bot.Utility import monotonic_time
+
+
+class CommandPriority(Enum):
+    # Answers to users, e.g text messages. Sent before everything else
+    INTERACTIVE = 0
+    # Default for commands sent by the bot and by plugins
+    NORMAL = 1
+    # Periodic polling. Identical commands waiting in this lane are only sent once
+    BACKGROUND = 2
+
+
+class QueryError(Exception):
+    """!
+    @brief Raised by awaited queries which were answered with an error id other than 0.
+    """
+
+    def __init__(self, query, error_id, error_message):
+        super().__init__("{0} failed with error {1}: {2}".format(query, error_id, error_message))
+        self.query = query
+        self.error_id = error_id
+        self.error_message = error_message
+
+
+class QueryTimeoutError(QueryError):
+    """!
+    @brief Raised by awaited queries which were not answered before their deadline.
+    """
+
+    def __init__(self, query):
+        super().__init__(query, -1, "query timed out")
+
+
 class Query:
-    def __init__(self, callback, data, text, err_callback):
+    def __init__(self, callback, data, text, err_callback, future=None):
         self.callback = callback
         self.data = data
         self.text = text
         self.errCallback = err_callback
         self.completed = False
+        # Resolved with the received records when the query completes, see TeamspeakBot.query
+        self.future = future
+        self.response = []
+        self.sent_at = None
+        self.deadline = None
+        self.timed_out = False
+
+    def resolve(self, error_id, error_message):
+        """!
+        @brief Resolves the future of this query, if there is one.
+
+        @param error_id The error id the server answered with
+        @param error_message The error message the server answered with
+        @return None
+        """
+        if self.future is None or self.future.done():
+            return
+        if int(error_id) == 0:
+            self.future.set_result(self.response)
+        else:
+            self.future.set_exception(QueryError(self.text, int(error_id), error_message))
+
+    def fail(self, exception):
+        """!
+        @brief Fails the future of this query without an answer of the server, e.g because it could not be sent.
+
+        @param exception The exception the future raises
+        @return None
+        """
+        if self.future is not None and not self.future.done():
+            self.future.set_exception(exception)
+
+    def time_out(self):
+        """!
+        @brief Marks the query as timed out and fails its future.
+
+        The query stays in flight, as its answer may still arrive and has to be matched to it.
+
+        @return None
+        """
+        self.timed_out = True
+        if self.future is not None and not self.future.done():
+            self.future.set_exception(QueryTimeoutError(self.text))
 
     def to_string(self):
         return "{0}|{1}|{2}|{3}|{4}".format(self.text, self.data, self.callback, self.errCallback, self.completed)
@@ -18,30 +97,94 @@ class Query:
 
 
 class QueryTracker:
+    """!
+    @brief Matches the answers of the server to the sent queries.
+
+    The server answers queries in the order they were sent, so the queries in flight are kept
+    in a FIFO. The first query is the one the next answer belongs to and is removed as soon as
+    its error line arrives.
+    """
+
     def __init__(self):
-        self._queryList = []
+        self._queryList = deque()
+
+    def add_query(self, query, timeout=None):
+        """!
+        @brief Adds a query which was just sent.
 
-    def add_query(self, query):
+        @param query The query
+        @param timeout Milliseconds after which the query times out, None for no timeout
+        @return None
+        """
+        query.sent_at = monotonic_time()
+        if timeout is not None:
+            query.deadline = query.sent_at + timeout
         self._queryList.append(query)
 
     def complete_last_query(self):
-        for query in self._queryList:
-            if not query.completed:
-                query.completed = True
-                return query
+        """!
+        @brief Removes and returns the query the received error line belongs to.
+
+        @return The query or None when no query is in flight, which means the answers are out of sync
+        """
+        if not self._queryList:
+            return None
+        query = self._queryList.popleft()
+        query.completed = True
+        return query
 
     def get_last_uncompleted_query(self):
+        """!
+        @brief Returns the query a received answer belongs to.
+
+        @return The query or None when no query is in flight, which means the answers are out of sync
+        """
+        if not self._queryList:
+            return None
+        return self._queryList[0]
+
+    def get_in_flight_count(self):
+        return len(self._queryList)
+
+    def get_oldest_query_age(self):
+        """!
+        @brief Returns for how many milliseconds the oldest query has been waiting for its answer.
+
+        @return Milliseconds or 0 when no query is in flight
+        """
+        if not self._queryList:
+            return 0
+        return monotonic_time() - self._queryList[0].sent_at
+
+    def check_timeouts(self):
+        """!
+        @brief Times out the queries whose deadline passed.
+
+        Queries are sent with the same timeout almost always, so their deadlines grow along the list and the
+        scan stops at the first query whose deadline has not passed. A query sent behind one with a longer
+        timeout therefore times out when that query does at the latest. Timed out queries stay in the list
+        until their answer arrives and are skipped, like queries without a timeout.
+
+        @return List of the queries which timed out with this call
+        """
+        now = monotonic_time()
+        timed_out = []
         for query in self._queryList:
-            if not query.completed:
-                return query
+            if query.timed_out or query.deadline is None:
+                continue
+            if query.deadline > now:
+                break
+            query.time_out()
+            timed_out.append(query)
+        return timed_out
 
     def to_string(self):
-        return str(self._queryList)
-
-    def clean_up(self):
-        self._queryList[:] = [x for x in self._queryList if not x.completed]
+        return str(list(self._queryList))
 
     def reset(self):
+        for query in self._queryList:
+            if query.future is not None and not query.future.done():
+                query.future.cancel()
         self._queryList.clear()
 
     def __str__(self):
@@ -49,3 +192,167 @@ class QueryTracker:
 
     def __repr__(self):
         return self.to_string()
+
+
+class TokenBucket:
+    """!
+    @brief Allows a burst of capacity commands and refills them evenly over refill_time milliseconds.
+
+    Configured with the flood settings of the server ( serverinstance_serverquery_flood_commands and
+    serverinstance_serverquery_flood_time ), it keeps the bot below the flood limit.
+    """
+
+    def __init__(self, capacity, refill_time):
+        self.capacity = capacity
+        self._rate = capacity / refill_time
+        self._tokens = capacity
+        self._updated = monotonic_time()
+
+    def _refill(self):
+        now = monotonic_time()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def try_consume(self):
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def get_time_until_token(self):
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def drain(self):
+        self._refill()
+        self._tokens = 0
+
+    def reset(self):
+        self._tokens = self.capacity
+        self._updated = monotonic_time()
+
+
+class CommandScheduler:
+    """!
+    @brief Queues outgoing queries in priority lanes and sends them as fast as the token bucket allows.
+
+    Queries are handed to send_function only when they are actually written to the socket, so the
+    query tracker sees them in the order the server receives them. Without a bucket every query is
+    sent right away.
+    """
+
+    def __init__(self, send_function, bucket=None, fail_function=None):
+        """!
+        @param send_function Called with a query and its timeout, returns False when the query could not be sent
+        @param bucket Optional TokenBucket limiting the send rate
+        @param fail_function Optional. Called with a query send_function could not send, which is dropped
+        """
+        self._send = send_function
+        self._fail = fail_function
+        self._bucket = bucket
+        self._lanes = [deque() for _ in CommandPriority]
+        self._background_texts = set()
+        self._sent = [0 for _ in CommandPriority]
+        self._wait_total = [0.0 for _ in CommandPriority]
+        self._wait_max = [0.0 for _ in CommandPriority]
+        self._coalesced = 0
+
+    def schedule(self, query, priority=CommandPriority.NORMAL, timeout=None):
+        """!
+        @brief Queues a query and sends as many queued queries as possible.
+
+        @param query The query to send
+        @param priority A CommandPriority
+        @param timeout Timeout of the query, passed on to send_function
+        @return None
+        """
+        if priority is CommandPriority.BACKGROUND:
+            if query.text in self._background_texts:
+                self._coalesced += 1
+                return
+            self._background_texts.add(query.text)
+        self._lanes[priority.value].append((query, timeout, monotonic_time()))
+        self.flush()
+
+    def flush(self):
+        """!
+        @brief Sends queued queries, highest priority first, until the bucket or the queue is empty.
+
+        @return None
+        """
+        for lane_index, lane in enumerate(self._lanes):
+            while lane:
+                if self._bucket is not None and not self._bucket.try_consume():
+                    return
+                query, timeout, queued_at = lane.popleft()
+                if lane_index == CommandPriority.BACKGROUND.value:
+                    self._background_texts.discard(query.text)
+                wait = monotonic_time() - queued_at
+                self._sent[lane_index] += 1
+                self._wait_total[lane_index] += wait
+                self._wait_max[lane_index] = max(self._wait_max[lane_index], wait)
+                if not self._send(query, timeout):
+                    if self._fail is not None:
+                        self._fail(query)
+                    return
+
+    def get_time_until_next_send(self):
+        """!
+        @brief Returns in how many milliseconds flush can send the next queued query.
+
+        @return Milliseconds or None when nothing is queued
+        """
+        if not self.get_queue_depth():
+            return None
+        if self._bucket is None:
+            return 0
+        return self._bucket.get_time_until_token()
+
+    def get_queue_depth(self, priority=None):
+        if priority is not None:
+            return len(self._lanes[priority.value])
+        return sum(len(lane) for lane in self._lanes)
+
+    def penalize(self):
+        """!
+        @brief Empties the bucket, e.g when the server reports that the bot is flooding.
+
+        @return None
+        """
+        if self._bucket is not None:
+            self._bucket.drain()
+
+    def get_stats(self):
+        """!
+        @brief Returns queue depth, sent commands and waiting times in milliseconds per lane.
+
+        @return Dictionary, keyed by the lowercase name of the priority
+        """
+        stats = {"coalesced": self._coalesced}
+        for priority in CommandPriority:
+            index = priority.value
+            stats[priority.name.lower()] = {
+                "queued": len(self._lanes[index]),
+                "sent": self._sent[index],
+                "wait_avg": self._wait_total[index] / self._sent[index] if self._sent[index] else 0.0,
+                "wait_max": self._wait_max[index]
+            }
+        return stats
+
+    def reset(self):
+        """!
+        @brief Drops every queued query and refills the bucket. Used when the connection is lost.
+
+        @return None
+        """
+        for lane in self._lanes:
+            for query, timeout, queued_at in lane:
+                if query.future is not None and not query.future.done():
+                    query.future.cancel()
+            lane.clear()
+        self._background_texts.clear()
+        if self._bucket is not None:
+            self._bucket.reset()
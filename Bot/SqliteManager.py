@@ -0,0 +1,93 @@
+# coding=utf-8
+import sqlite3
+
+from Bot.StorageManager import StorageManager, DatabaseConnectionError
+
+
+def _dict_factory(cursor, row):
+    return {column[0]: row[index] for index, column in enumerate(cursor.description)}
+
+
+class SqliteManager(StorageManager):
+    UPSERT_ONLINE_CLIENT = ("REPLACE INTO OnlineClients (`clid`, `cldbid`, `name`, `remote_ip`, `accesslevel`) "
+                            "VALUES (%s, %s, %s, %s, %s)")
+    DatabaseError = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+    # Number of prepared statements sqlite keeps per connection
+    CACHED_STATEMENTS = 256
+    # Seconds to wait for the lock of another connection, e.g the one of the database executor
+    BUSY_TIMEOUT = 5
+
+    # The tables of db/2017-09-22_23_30.sql
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS `OnlineClients` ("
+        "  `clid` INTEGER NOT NULL DEFAULT 0 PRIMARY KEY,"
+        "  `cldbid` INTEGER DEFAULT NULL,"
+        "  `name` VARCHAR(100) DEFAULT NULL,"
+        "  `remote_ip` VARCHAR(100) DEFAULT NULL,"
+        "  `accesslevel` INTEGER DEFAULT NULL"
+        ")",
+        "CREATE TABLE IF NOT EXISTS `Settings` ("
+        "  `key` VARCHAR(100) NOT NULL DEFAULT '' PRIMARY KEY,"
+        "  `value` VARCHAR(100) DEFAULT NULL"
+        ")",
+        "CREATE TABLE IF NOT EXISTS `ClientSettings` ("
+        "  `cldbid` INTEGER NOT NULL DEFAULT 0,"
+        "  `key` VARCHAR(100) NOT NULL DEFAULT '',"
+        "  `value` TEXT,"
+        "  PRIMARY KEY (`cldbid`, `key`)"
+        ")"
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._connection = None
+        self._path = None
+
+    def connect_to_db(self, path):
+        """!
+        @brief Opens the database file, creating it and its tables if needed.
+
+        @param path Path of the database file
+        @return None
+        """
+        self._path = path
+        try:
+            self._connection = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT, isolation_level=None,
+                                               cached_statements=self.CACHED_STATEMENTS)
+        except sqlite3.Error as e:
+            raise DatabaseConnectionError("could not open {0}: {1}".format(path, e)) from e
+        self._connection.row_factory = _dict_factory
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._connection.execute(statement)
+
+    @staticmethod
+    def _translate(sql_query):
+        # the queries are written for pymysql, which uses %s placeholders
+        return sql_query.replace("%s", "?")
+
+    def _reconnect(self):
+        self.connect_to_db(self._path)
+
+    def _is_duplicate_key(self, error):
+        # other constraint violations, e.g NOT NULL ones, raise IntegrityError as well
+        return isinstance(error, sqlite3.IntegrityError) and "UNIQUE constraint failed" in str(error)
+
+    def _execute(self, sql_query, args):
+        return self._connection.execute(self._translate(sql_query), args)
+
+    def _executemany(self, sql_query, args_list):
+        self._connection.executemany(self._translate(sql_query), args_list)
+
+    def _begin(self):
+        self._connection.execute("BEGIN")
+
+    def _commit(self):
+        self._connection.execute("COMMIT")
+
+    def _rollback(self):
+        if self._connection.in_transaction:
+            self._connection.execute("ROLLBACK")
@@ -0,0 +1,537 @@
+# coding=utf-8
+from abc import ABC, abstractmethod
+
+from Bot.Utility import monotonic_time, LRUCache
+
+# Cached for Settings keys which do not exist, so that missing keys are not queried again
+_MISSING_SETTING = object()
+# Returned by the caches on a miss
+_CACHE_MISS = object()
+
+
+class DatabaseConnectionError(Exception):
+    """!
+    @brief Raised by the backends when they can not connect to their database.
+    """
+
+
+class PendingOnlineClient:
+    """!
+    @brief Coalesced mutations of a single OnlineClients row which were not written yet.
+    """
+
+    __slots__ = ("row", "updates", "delete")
+
+    def __init__(self):
+        # complete row to upsert, None when the client was not (re)added
+        self.row = None
+        # column -> value, for updates of a row which already is in the database
+        self.updates = {}
+        # whether the row has to be deleted
+        self.delete = False
+
+
+class InFlightBatch:
+    """!
+    @brief A write behind batch which was handed to the database executor and is not confirmed yet.
+    """
+
+    __slots__ = ("batch", "clients", "clear", "start", "pending_since", "done", "error")
+
+    def __init__(self, batch, clients, clear, start, pending_since):
+        self.batch = batch
+        # the PendingOnlineClient instances the batch was built from, requeued when it fails
+        self.clients = clients
+        self.clear = clear
+        self.start = start
+        self.pending_since = pending_since
+        # set by the executor thread once the batch was executed
+        self.done = False
+        self.error = None
+
+
+class StorageManager(ABC):
+    """!
+    @brief Storage of the online clients, client settings and global settings.
+
+    Implements caching, write behind buffering and all table specific queries. Backends subclass it and
+    provide the connection and the driver specific primitives. Queries use %s placeholders.
+    """
+
+    # Statement inserting a complete OnlineClients row or replacing an existing one
+    UPSERT_ONLINE_CLIENT = None
+    # Base class of all exceptions raised by the database driver
+    DatabaseError = Exception
+    # Exception raised by the database driver on constraint violations
+    IntegrityError = Exception
+
+    def __init__(self):
+        self._writeBehind = False
+        self._maxPending = 0
+        self._writeBehindExecutor = None
+        self._pendingClients = {}  # clid -> PendingOnlineClient
+        self._pendingClear = False
+        self._pendingSince = None
+        self._writtenClients = set()  # clids whose rows were written by the write behind buffer
+        self._inFlight = None  # InFlightBatch the executor is writing
+        self._clientSettingsCache = None  # cldbid -> dictionary of all ClientSettings of that client
+        self._settingsCache = None  # key -> value of Settings
+        self._latencyObserver = None
+        self._writeBehindStats = {
+            "flushes": 0,
+            "rows": 0,
+            "coalesced": 0,
+            "failed_flushes": 0,
+            "flush_time_last": 0,
+            "flush_time_max": 0,
+            "flush_time_total": 0,
+            "delay_max": 0
+        }
+
+    @abstractmethod
+    def _execute(self, sql_query, args):
+        pass
+
+    @abstractmethod
+    def _executemany(self, sql_query, args_list):
+        pass
+
+    @abstractmethod
+    def _begin(self):
+        pass
+
+    @abstractmethod
+    def _commit(self):
+        pass
+
+    @abstractmethod
+    def _rollback(self):
+        pass
+
+    @abstractmethod
+    def _reconnect(self):
+        pass
+
+    def _is_connection_lost(self, error):
+        return False
+
+    def _is_duplicate_key(self, error):
+        return False
+
+    def set_latency_observer(self, observer):
+        """!
+        @brief Sets a callable which is called with ("query", milliseconds) after every query and with
+        ("flush", milliseconds) after every write behind transaction.
+
+        @param observer The callable, None to remove it
+        @return None
+        """
+        self._latencyObserver = observer
+
+    def execute_query(self, sql_query, *args):
+        """!
+        @brief Executes a query. Reconnects when the connection was lost and ignores duplicate key errors,
+        None is returned in both cases.
+
+        @param sql_query The query, with %s placeholders for args
+        @param args The query parameters
+        @return The cursor or None
+        """
+        if self._latencyObserver is None:
+            return self._execute_query(sql_query, args)
+        start = monotonic_time()
+        try:
+            return self._execute_query(sql_query, args)
+        finally:
+            self._latencyObserver("query", monotonic_time() - start)
+
+    def _execute_query(self, sql_query, args):
+        try:
+            return self._execute(sql_query, args)
+        except self.DatabaseError as e:
+            if self._is_connection_lost(e):
+                self._reconnect()
+            elif self._is_duplicate_key(e):
+                pass
+            else:
+                raise
+
+    def enable_cache(self, size=1000, ttl=60000):
+        """!
+        @brief Caches ClientSettings and Settings reads. Writes through this manager update the cache,
+        changes made by other programs or raw queries become visible once their entry expired.
+
+        @param size Maximum number of clients and maximum number of settings to cache
+        @param ttl Lifetime of a cached entry in milliseconds
+        @return None
+        """
+        self._clientSettingsCache = LRUCache(size, ttl)
+        self._settingsCache = LRUCache(size, ttl)
+
+    def get_cache_stats(self):
+        """!
+        @brief Returns the counters of the ClientSettings and Settings caches.
+
+        @return Dictionary with the keys client_settings and settings or None if the cache is disabled
+        """
+        if self._clientSettingsCache is None:
+            return None
+        return {
+            "client_settings": self._clientSettingsCache.get_stats(),
+            "settings": self._settingsCache.get_stats()
+        }
+
+    def enable_write_behind(self, max_pending=500, executor=None):
+        """!
+        @brief Buffers all OnlineClients mutations until flush is called or max_pending clients have pending mutations.
+
+        @param max_pending Number of clients with pending mutations which triggers a flush
+        @param executor Optional DatabaseExecutor which writes the buffered mutations off the bot thread
+        @return None
+        """
+        self._writeBehind = True
+        self._maxPending = max_pending
+        self._writeBehindExecutor = executor
+
+    def _get_pending_client(self, clid):
+        clid = int(clid)
+        if self._pendingSince is None:
+            self._pendingSince = monotonic_time()
+        pending = self._pendingClients.get(clid)
+        if pending is None:
+            pending = self._pendingClients[clid] = PendingOnlineClient()
+        else:
+            self._writeBehindStats["coalesced"] += 1
+        return pending
+
+    def _check_pending_size(self):
+        if len(self._pendingClients) >= self._maxPending:
+            self.flush()
+
+    def _queue_online_client_update(self, clid, column, value):
+        pending = self._get_pending_client(clid)
+        if pending.row is not None:
+            pending.row[column] = value
+        elif not pending.delete:
+            pending.updates[column] = value
+        self._check_pending_size()
+
+    def _build_pending_batch(self):
+        upserts = []
+        deletes = []
+        updates = {}
+        for clid, pending in self._pendingClients.items():
+            if pending.row is not None:
+                row = pending.row
+                upserts.append((str(clid), row["cldbid"], row["name"], row["remote_ip"], row["accesslevel"]))
+            elif pending.delete:
+                deletes.append(clid)
+            else:
+                for column, value in pending.updates.items():
+                    updates.setdefault(column, []).append((value, clid))
+        return self._pendingClear, deletes, upserts, updates
+
+    def _mark_batch_written(self, batch):
+        clear, deletes, upserts, updates = batch
+        if clear:
+            self._writtenClients.clear()
+        self._writtenClients.difference_update(deletes)
+        self._writtenClients.update(int(upsert[0]) for upsert in upserts)
+
+    def _clear_pending_batch(self):
+        self._pendingClients = {}
+        self._pendingClear = False
+        self._pendingSince = None
+
+    def _may_be_written(self, clid):
+        if clid in self._writtenClients:
+            return True
+        # an upsert the executor is writing counts as written, deleting a row which does not exist is harmless
+        in_flight = self._inFlight
+        return in_flight is not None and clid in in_flight.clients and in_flight.clients[clid].row is not None
+
+    def _requeue_in_flight(self, in_flight):
+        """!
+        @brief Makes the mutations of a failed batch pending again, below the ones queued since it was sent.
+        """
+        if self._pendingClear:
+            # cleared again in the meantime, the failed mutations are obsolete
+            return
+        self._pendingClear = in_flight.clear
+        for clid, failed in in_flight.clients.items():
+            pending = self._pendingClients.get(clid)
+            if pending is None:
+                self._pendingClients[clid] = failed
+            elif pending.row is None and not pending.delete:
+                # only column updates were queued since, they apply on top of the failed mutation
+                if failed.row is not None:
+                    failed.row.update(pending.updates)
+                elif not failed.delete:
+                    failed.updates.update(pending.updates)
+                self._pendingClients[clid] = failed
+        if self._pendingSince is None or in_flight.pending_since < self._pendingSince:
+            self._pendingSince = in_flight.pending_since
+
+    def write_online_client_batch(self, batch):
+        """!
+        @brief Writes a batch of the write behind buffer in a single transaction.
+
+        Reconnects and retries once when the connection to the database was lost.
+
+        @param batch The batch as built by the write behind buffer
+        @return None
+        """
+        clear, deletes, upserts, updates = batch
+        for attempt in range(2):
+            try:
+                self._begin()
+                if clear:
+                    self._execute("DELETE FROM OnlineClients", ())
+                if deletes:
+                    self._execute("DELETE FROM OnlineClients WHERE `clid` IN ({0})".format(
+                        ", ".join(["%s"] * len(deletes))), deletes)
+                if upserts:
+                    self._executemany(self.UPSERT_ONLINE_CLIENT, upserts)
+                for column, values in updates.items():
+                    self._executemany("UPDATE OnlineClients set `{0}`=%s WHERE clid=%s;".format(column), values)
+                self._commit()
+                return
+            except self.DatabaseError as e:
+                try:
+                    self._rollback()
+                except self.DatabaseError:
+                    pass
+                if attempt > 0 or not self._is_connection_lost(e):
+                    raise
+                self._reconnect()
+
+    def _on_batch_written(self, batch, start, pending_since):
+        clear, deletes, upserts, updates = batch
+        now = monotonic_time()
+        flush_time = now - start
+        stats = self._writeBehindStats
+        stats["flushes"] += 1
+        stats["rows"] += len(upserts) + len(deletes) + sum(len(values) for values in updates.values())
+        stats["flush_time_last"] = flush_time
+        stats["flush_time_max"] = max(stats["flush_time_max"], flush_time)
+        stats["flush_time_total"] += flush_time
+        stats["delay_max"] = max(stats["delay_max"], now - pending_since)
+        if self._latencyObserver is not None:
+            self._latencyObserver("flush", flush_time)
+
+    def flush(self, background=True):
+        """!
+        @brief Writes all pending OnlineClients mutations in a single transaction.
+
+        When the write behind buffer was enabled with an executor and background is true, the transaction
+        runs on the executor thread. Only one batch is written there at a time, mutations made meanwhile are
+        written by the next flush. A batch which fails there is printed and its mutations become pending again.
+
+        Otherwise the executor is drained first, so that the batches are committed in order, and the transaction
+        runs on this connection. When the connection to the database was lost, the mutations stay pending and
+        will be written by the next flush.
+
+        @param background Whether the executor may be used
+        @return False if the connection to the database was lost, True otherwise
+        """
+        if self._inFlight is not None:
+            if background:
+                return True
+            self._writeBehindExecutor.drain()
+            in_flight = self._inFlight
+            if in_flight.done:
+                self._finish_in_flight(in_flight, in_flight.error)
+            else:
+                # the executor failed the job without running it, e.g because it could not connect
+                self._finish_in_flight(in_flight, RuntimeError("the database thread did not write the batch"))
+
+        if not self._pendingClear and not self._pendingClients:
+            self._pendingSince = None
+            return True
+
+        start = monotonic_time()
+        pending_since = self._pendingSince
+        batch = self._build_pending_batch()
+        if background and self._writeBehindExecutor is not None:
+            in_flight = InFlightBatch(batch, self._pendingClients, self._pendingClear, start, pending_since)
+            self._inFlight = in_flight
+            self._clear_pending_batch()
+            future = self._writeBehindExecutor.submit(StorageManager._write_in_flight_batch, in_flight)
+            future.add_done_callback(lambda f: self._on_async_flush_done(f, in_flight))
+            return True
+
+        try:
+            self.write_online_client_batch(batch)
+        except self.DatabaseError as e:
+            self._writeBehindStats["failed_flushes"] += 1
+            if self._is_connection_lost(e):
+                return False
+            raise
+
+        self._mark_batch_written(batch)
+        self._clear_pending_batch()
+        self._on_batch_written(batch, start, pending_since)
+        return True
+
+    @staticmethod
+    def _write_in_flight_batch(manager, in_flight):
+        # runs on the executor thread
+        try:
+            manager.write_online_client_batch(in_flight.batch)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            in_flight.done = True
+
+    def _on_async_flush_done(self, future, in_flight):
+        if future.cancelled():
+            self._finish_in_flight(in_flight, RuntimeError("the flush was cancelled"))
+        else:
+            self._finish_in_flight(in_flight, future.exception())
+
+    def _finish_in_flight(self, in_flight, error):
+        if self._inFlight is not in_flight:
+            # already finished by a synchronous flush
+            return
+        self._inFlight = None
+        if error is not None:
+            self._writeBehindStats["failed_flushes"] += 1
+            print("Could not write OnlineClients, retrying with the next flush: {0}".format(error))
+            self._requeue_in_flight(in_flight)
+            return
+        self._mark_batch_written(in_flight.batch)
+        self._on_batch_written(in_flight.batch, in_flight.start, in_flight.pending_since)
+
+    def fetch_all(self, sql_query, *args):
+        """!
+        @brief Executes a query and returns all rows.
+
+        @param sql_query The query, with %s placeholders for args
+        @param args The query parameters
+        @return List of rows, each row being a dictionary
+        """
+        cursor = self.execute_query(sql_query, *args)
+        if cursor is None:
+            return []
+        return list(cursor.fetchall())
+
+    def get_write_behind_stats(self):
+        """!
+        @brief Returns counters of the write behind buffer. All times are in milliseconds.
+
+        delay_max is the longest time a mutation was pending before it was written.
+
+        @return Dictionary
+        """
+        stats = dict(self._writeBehindStats)
+        stats["enabled"] = self._writeBehind
+        stats["pending"] = len(self._pendingClients)
+        stats["flush_time_avg"] = stats["flush_time_total"] / stats["flushes"] if stats["flushes"] else 0
+        return stats
+
+    def add_online_client(self, clid, cldbid, name, remote_ip, accesslevel):
+        if self._writeBehind:
+            pending = self._get_pending_client(clid)
+            pending.row = {"cldbid": str(cldbid), "name": str(name), "remote_ip": str(remote_ip),
+                           "accesslevel": accesslevel}
+            pending.updates.clear()
+            self._check_pending_size()
+            return True
+        try:
+            self.execute_query("INSERT INTO OnlineClients (`clid`, `cldbid`, `name`, `remote_ip`, `accesslevel`) "
+                               "VALUES (%s, %s, %s, %s, %s);",
+                               str(clid), str(cldbid), str(name), str(remote_ip), accesslevel)
+            return True
+        except self.IntegrityError:
+            return False
+
+    def set_client_accesslevel(self, clid, accesslevel):
+        if self._writeBehind:
+            self._queue_online_client_update(clid, "accesslevel", accesslevel)
+            return
+        self.execute_query("UPDATE OnlineClients set accesslevel=%s WHERE clid=%s;", accesslevel, clid)
+
+    def set_client_ip(self, clid, remote_ip):
+        if self._writeBehind:
+            self._queue_online_client_update(clid, "remote_ip", remote_ip)
+            return
+        self.execute_query("UPDATE OnlineClients set remote_ip=%s WHERE clid=%s;", remote_ip, clid)
+
+    def remove_online_client(self, clid):
+        if self._writeBehind:
+            pending = self._get_pending_client(clid)
+            if pending.row is not None and not self._may_be_written(int(clid)):
+                # the row was never written, nothing to delete
+                del self._pendingClients[int(clid)]
+            else:
+                pending.row = None
+                pending.updates.clear()
+                pending.delete = True
+                self._check_pending_size()
+            return True
+        try:
+            cursor = self.execute_query("DELETE FROM OnlineClients WHERE `clid` = %s", str(clid))
+            if cursor is not None and cursor.rowcount > 0:
+                return True
+            return False
+        except self.IntegrityError:
+            return False
+
+    def clear_online_clients(self):
+        if self._writeBehind:
+            self._pendingClients.clear()
+            self._pendingClear = True
+            if self._pendingSince is None:
+                self._pendingSince = monotonic_time()
+            return
+        self.execute_query("DELETE FROM OnlineClients")
+
+    def set_client_value(self, cldbid, key, value):
+        self.execute_query("REPLACE INTO ClientSettings (cldbid, `key`, value) VALUES (%s, %s, %s);",
+                           int(cldbid), str(key), value)
+        if self._clientSettingsCache is not None:
+            values = self._clientSettingsCache.get(int(cldbid))
+            if values is not None:
+                values[str(key)] = value
+
+    def get_client_value(self, cldbid, key, default_value=None):
+        if self._clientSettingsCache is not None:
+            return self.get_client_values(cldbid).get(str(key), default_value)
+        ret = self.execute_query("SELECT `value` "
+                                 "FROM ClientSettings "
+                                 "WHERE cldbid=%s AND `key`=%s", int(cldbid), str(key)).fetchone()
+        if ret is None:
+            return default_value
+        return ret["value"]
+
+    def get_client_values(self, cldbid):
+        if self._clientSettingsCache is not None:
+            values = self._clientSettingsCache.get(int(cldbid))
+            if values is not None:
+                return dict(values)
+        ret = self.execute_query("SELECT `key`, `value` FROM ClientSettings WHERE cldbid=%s", int(cldbid)).fetchall()
+        ret = {d["key"]: d["value"] for d in ret} if ret else {}
+        if self._clientSettingsCache is not None:
+            # the caller may modify the returned dictionary, so the cache keeps its own copy
+            self._clientSettingsCache.set(int(cldbid), dict(ret))
+        return ret
+
+    def get_value(self, key, default_value=None):
+        if self._settingsCache is not None:
+            value = self._settingsCache.get(key, _CACHE_MISS)
+            if value is _MISSING_SETTING:
+                return default_value
+            if value is not _CACHE_MISS:
+                return value
+        ret = self.execute_query("SELECT `value` FROM Settings WHERE `key`=%s", key).fetchone()
+        if self._settingsCache is not None:
+            self._settingsCache.set(key, _MISSING_SETTING if ret is None else ret["value"])
+        if ret is None:
+            return default_value
+        return ret["value"]
+
+    def set_value(self, key, value):
+        self.execute_query("REPLACE INTO Settings (`key`, value) VALUES (%s, %s);", key, value)
+        if self._settingsCache is not None:
+            self._settingsCache.set(key, value)
@@ -1,7 +1,11 @@
 # coding=utf-8
+import heapq
 import re
 import time
 import os
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from sys import intern
 
 
 def log(message):
@@ -24,37 +28,258 @@ class ChatCommand:
         self.args = args
 
 
+class PluginDispatcher:
+    """!
+    @brief Keeps the loaded plugins and, per hook, the plugins which actually implement it.
+
+    A plugin which inherits the empty implementation of a hook from the base class is left out of the
+    list of that hook, so an event only costs a call for the plugins handling it. The lists hold bound
+    methods in plugin order and are rebuilt whenever a plugin is registered or unregistered.
+    """
+
+    # Prefix of the methods of the base class which are hooks
+    HOOK_PREFIX = "on_"
+
+    def __init__(self, base_class, wrap_handler=None):
+        """!
+        @param base_class The class whose on_ methods are the hooks and whose implementations are no-ops
+        @param wrap_handler Optional. Called with every bound method while the lists are built, the returned
+            callable is put into the list instead.
+        """
+        self._baseClass = base_class
+        self._wrapHandler = wrap_handler
+        self._hooks = [name for name in dir(base_class) if name.startswith(self.HOOK_PREFIX)]
+        self._plugins = []
+        self._handlers = {}
+
+    def register(self, plugin):
+        """!
+        @brief Adds a plugin. Plugins are kept sorted by their order attribute, plugins with the same order
+        keep the order in which they were registered.
+
+        @param plugin The plugin instance
+        @return None
+        """
+        self._plugins.append(plugin)
+        self._plugins.sort(key=lambda registered_plugin: registered_plugin.order)
+        self.rebuild()
+
+    def unregister(self, plugin):
+        """!
+        @brief Removes a plugin.
+
+        @param plugin The plugin instance
+        @return Boolean. False when the plugin was not registered.
+        """
+        if plugin not in self._plugins:
+            return False
+        self._plugins.remove(plugin)
+        self.rebuild()
+        return True
+
+    def rebuild(self):
+        """!
+        @brief Recomputes the handler lists, e.g after a plugin replaced one of its hooks at runtime.
+
+        @return None
+        """
+        handlers = {}
+        for hook in self._hooks:
+            empty_implementation = getattr(self._baseClass, hook)
+            handlers[hook] = [getattr(plugin, hook) for plugin in self._plugins
+                              if getattr(getattr(plugin, hook), "__func__", None) is not empty_implementation]
+            if self._wrapHandler is not None:
+                handlers[hook] = [self._wrapHandler(handler) for handler in handlers[hook]]
+        # replaced instead of changed, so a dispatch which is running while a plugin is (un)registered is not affected
+        self._handlers = handlers
+
+    def get_handlers(self, hook):
+        """!
+        @brief Returns the bound methods of the plugins which implement the hook.
+
+        @param hook The name of the hook, e.g on_client_moved
+        @return List of callables, in plugin order
+        """
+        return self._handlers.get(hook, ())
+
+    def get_plugins(self):
+        return list(self._plugins)
+
+
 class Timer:
+    """!
+    @brief Calls callbacks after an interval, either once or repeatedly.
+
+    Timers are kept in a min-heap ordered by their deadline on the monotonic clock, so
+    checking whether any timer is due only looks at the top of the heap. Removed timers
+    are marked and dropped lazily once they reach the top, or all at once when they make up
+    more than half of the heap. That compaction is put off while callbacks run.
+    """
+
+    # Indices into a timer entry
+    _DEADLINE, _ID, _CALLBACK, _INTERVAL, _SINGLE_SHOT, _ARGS = range(6)
+
     def __init__(self):
         self._timer_list = {}
+        self._heap = []
+        self._cancelled = 0
         self._timer_counter = 0
+        self._checking = False
 
     def start_timer(self, callback, interval, is_single_shot=False, *args):
         self._timer_counter += 1
-        self._timer_list[self._timer_counter] = [callback, time_since_epoch()+interval, interval, is_single_shot, args]
+        timer = [monotonic_time() + interval, self._timer_counter, callback, interval, is_single_shot, args]
+        self._timer_list[self._timer_counter] = timer
+        heapq.heappush(self._heap, timer)
         return self._timer_counter
 
     def remove_timer(self, timer_id):
-        if timer_id in self._timer_list:
-            self._timer_list.pop(timer_id)
-            return True
-        return False
+        timer = self._timer_list.pop(timer_id, None)
+        if timer is None:
+            return False
+        timer[self._CALLBACK] = None
+        self._cancelled += 1
+        if not self._checking:
+            self._compact()
+        return True
+
+    def _compact(self):
+        if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+            # in place, the heap must stay the same list for check_timers
+            self._heap[:] = [entry for entry in self._heap if entry[self._CALLBACK] is not None]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
 
     def check_timers(self):
-        for i in dict(self._timer_list):
-            timer = self._timer_list[i]
-            if time_since_epoch() > timer[1]:
-                timer[0](*timer[4])
-                timer[1] = time_since_epoch() + timer[2]
-                if timer[3]:
-                    self._timer_list.pop(i)
+        heap = self._heap
+        now = monotonic_time()
+        rescheduled = []
+        self._checking = True
+        try:
+            while heap and heap[0][self._DEADLINE] <= now:
+                timer = heapq.heappop(heap)
+                if timer[self._CALLBACK] is None:
+                    self._cancelled -= 1
+                    continue
+                if timer[self._SINGLE_SHOT]:
+                    del self._timer_list[timer[self._ID]]
+                timer[self._CALLBACK](*timer[self._ARGS])
+                if timer[self._CALLBACK] is None:
+                    # Removed by its own callback while it was not inside the heap
+                    self._cancelled -= 1
+                elif not timer[self._SINGLE_SHOT]:
+                    rescheduled.append(timer)
+        finally:
+            self._checking = False
+            for timer in rescheduled:
+                timer[self._DEADLINE] = monotonic_time() + timer[self._INTERVAL]
+                heapq.heappush(heap, timer)
+        self._compact()
+
+    def get_next_deadline(self):
+        """!
+        @brief Returns the deadline of the next timer on the clock of monotonic_time().
+
+        @return Milliseconds or None when no timer is running
+        """
+        heap = self._heap
+        while heap and heap[0][self._CALLBACK] is None:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+        if not heap:
+            return None
+        return heap[0][self._DEADLINE]
+
+    def get_time_until_next_timer(self):
+        """!
+        @brief Returns the time in milliseconds until the next timer is due.
+
+        @return Milliseconds, 0 when a timer is overdue or None when no timer is running
+        """
+        deadline = self.get_next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - monotonic_time(), 0)
 
     @staticmethod
     def get_seconds(seconds):
         return 1000 * seconds
 
     def reset(self):
+        for timer in self._timer_list.values():
+            timer[self._CALLBACK] = None
         self._timer_list.clear()
+        self._heap = []
+        self._cancelled = 0
+
+
+class LRUCache:
+    """!
+    @brief Bounded mapping which evicts the least recently used entry once it is full.
+
+    Entries older than ttl milliseconds are treated as missing and dropped on access.
+    """
+
+    def __init__(self, size, ttl=0):
+        """!
+        @param size Maximum number of entries
+        @param ttl Lifetime of an entry in milliseconds, 0 keeps entries until they are evicted
+        """
+        self._size = size
+        self._ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key, default_value=None):
+        """!
+        @brief Returns the cached value for key and marks it as recently used.
+
+        @param key The key
+        @param default_value The value to return on a miss
+        @return The cached value or default_value
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return default_value
+        if self._ttl and entry[1] <= monotonic_time():
+            del self._entries[key]
+            self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return default_value
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry[0]
+
+    def set(self, key, value):
+        """!
+        @brief Caches value for key, evicting the least recently used entry when the cache is full.
+
+        @param key The key
+        @param value The value
+        @return None
+        """
+        self._entries[key] = (value, monotonic_time() + self._ttl if self._ttl else 0)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        """!
+        @brief Returns hit, miss, eviction and expiration counters and the current size.
+
+        @return Dictionary
+        """
+        stats = dict(self._stats)
+        stats["size"] = len(self._entries)
+        return stats
 
 
 class Event:
@@ -77,7 +302,39 @@ def starts_with_c_i(string, compare):
     return string.lower().startswith(compare.lower())
 
 
+_UNESCAPE_MAP = {
+    "\\": "\\",
+    "/": "/",
+    "s": " ",
+    "p": "|",
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v"
+}
+
+_UNESCAPE_PATTERN = re.compile(r"\\([\\/spabfnrtv])")
+
+
+def _unescape_match(match):
+    return _UNESCAPE_MAP[match.group(1)]
+
+
 def escape(message):
+    """!
+    @brief Escapes a string for the teamspeak server query.
+
+    The backslash has to be replaced first, otherwise the backslashes of the other
+    escape sequences would be escaped again. str.replace returns the string itself
+    when there is nothing to replace, which keeps this faster than any single pass
+    implementation ( see bench/codec.py ).
+
+    @param message The string to escape
+    @return The escaped string
+    """
     message = message.replace("\\", "\\\\")
     message = message.replace("/", "\\/")
     message = message.replace(" ", "\\s")
@@ -93,42 +350,144 @@ def escape(message):
 
 
 def unescape(message):
-    message = message.replace("\\\\", "\\")
-    message = message.replace("\\/", "/")
-    message = message.replace("\\s", " ")
-    message = message.replace("\\p", "|")
-    message = message.replace("\\a", "\a")
-    message = message.replace("\\b", "\b")
-    message = message.replace("\\f", "\f")
-    message = message.replace("\\n", "\n")
-    message = message.replace("\\r", "\r")
-    message = message.replace("\\t", "\t")
-    message = message.replace("\\v", "\v")
-    return message
+    """!
+    @brief Reverts escape() in a single pass.
+
+    Every escape sequence is consumed as a whole, so an escaped backslash followed by
+    an "s" stays a backslash followed by an "s". Unknown sequences are left untouched.
+
+    @param message The string to unescape
+    @return The unescaped string
+    """
+    if "\\" not in message:
+        return message
+    return _UNESCAPE_PATTERN.sub(_unescape_match, message)
 
 
 def extract_args(message):
-    split = re.split("\s+", message)
+    """!
+    @brief Parses a single record of a query answer into a dictionary.
+
+    The record is split on whitespace and every token on its first "=". Tokens without
+    a "=" get an empty value. Keys are interned, as the same few field names are seen
+    over and over again.
+
+    @param message A single record, e.g "clid=1 cid=1 client_nickname=Client1"
+    @return Dictionary
+    """
     value_map = {}
-    for i in split:
-        re_match = re.search("(^.*?)=(.*)", i)
-        if re_match:
-            key = re_match.group(1)
-            value = re_match.group(2)
-        else:
-            key = i
-            value = ""
-        value_map[key] = unescape(value)
+    for token in message.split():
+        key, _, value = token.partition("=")
+        if "\\" in value:
+            value = _UNESCAPE_PATTERN.sub(_unescape_match, value)
+        value_map[intern(key)] = value
     return value_map
 
 
 def normalize_message(message):
-    ret = []
-    split = message.split("|")
-    for i in split:
-        ret.append(extract_args(i))
-    return ret
+    """!
+    @brief Parses a complete query answer into a list of dictionaries, one per record.
+
+    @param message The answer as received from the server
+    @return List of dictionaries
+    """
+    return [extract_args(record) for record in message.split("|")]
+
+
+class LazyRecord(MutableMapping):
+    """!
+    @brief A single record of a query answer which is parsed on first access.
+
+    Behaves like the dictionary extract_args() would return for the same record. The record
+    is split into its fields when it is accessed for the first time and a value is only
+    unescaped when its key is read. copy() returns a plain dictionary.
+    """
+
+    __slots__ = ("_raw", "_values", "_escaped")
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._values = None
+        self._escaped = None
+
+    def _parse(self):
+        values = {}
+        escaped = None
+        for token in self._raw.split():
+            key, _, value = token.partition("=")
+            key = intern(key)
+            if "\\" in value:
+                if escaped is None:
+                    escaped = set()
+                escaped.add(key)
+            elif escaped is not None:
+                escaped.discard(key)
+            values[key] = value
+        self._values = values
+        self._escaped = escaped
+        self._raw = None
+        return values
+
+    def __getitem__(self, key):
+        values = self._values if self._raw is None else self._parse()
+        value = values[key]
+        if self._escaped is not None and key in self._escaped:
+            self._escaped.discard(key)
+            value = values[key] = _UNESCAPE_PATTERN.sub(_unescape_match, value)
+        return value
+
+    def __setitem__(self, key, value):
+        values = self._values if self._raw is None else self._parse()
+        if self._escaped is not None:
+            self._escaped.discard(key)
+        values[key] = value
+
+    def __delitem__(self, key):
+        values = self._values if self._raw is None else self._parse()
+        if self._escaped is not None:
+            self._escaped.discard(key)
+        del values[key]
+
+    def __contains__(self, key):
+        values = self._values if self._raw is None else self._parse()
+        return key in values
+
+    def __iter__(self):
+        values = self._values if self._raw is None else self._parse()
+        return iter(values)
+
+    def __len__(self):
+        values = self._values if self._raw is None else self._parse()
+        return len(values)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def copy(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+def normalize_message_lazy(message):
+    """!
+    @brief Same as normalize_message, but returns LazyRecord instances instead of dictionaries.
+
+    @param message The answer as received from the server
+    @return List of LazyRecord
+    """
+    return [LazyRecord(record) for record in message.split("|")]
 
 
 def time_since_epoch():
     return time.time() * 1000
+
+
+def monotonic_time():
+    """!
+    @brief Milliseconds on a clock which is not affected by system time changes. Only useful for differences.
+    """
+    return time.monotonic() * 1000
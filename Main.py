@@ -1,6 +1,5 @@
 # coding=utf-8
 
-import time
 from Globals import config
 from Bot.Main import TeamspeakBot
 
@@ -22,7 +21,7 @@ def main():
     bot.login_use()
 
     while True:
-        time.sleep(10 / 1000)
+        bot.wait_for_events()
         bot.process()
 
 
@@ -1,15 +1,160 @@
 # coding=utf-8
+import asyncio
 import socket
 import select
+from collections import deque
+
+
+class MessageFramer:
+    """!
+    @brief Splits a stream of bytes into the messages sent by the teamspeak server query.
+
+    Received data is collected in a bytearray. The position up to which the buffer was
+    already searched for a separator is remembered, so no byte is scanned twice, no matter
+    in how many chunks a message arrives. Complete messages are decoded and queued.
+    """
+
+    SEPARATOR = b"\n\r"
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanOffset = 0
+        self._messages = deque()
+
+    def feed(self, data):
+        """!
+        @brief Appends received data and queues every message completed by it.
+
+        @param data Bytes received from the socket
+        @return The number of queued messages
+        """
+        buffer = self._buffer
+        buffer += data
+        position = buffer.find(self.SEPARATOR, self._scanOffset)
+        if position == -1:
+            # The last byte might be the first half of a separator
+            self._scanOffset = max(len(buffer) - 1, 0)
+            return len(self._messages)
+
+        start = 0
+        with memoryview(buffer) as view:
+            while position != -1:
+                self._messages.append(str(view[start:position], "utf-8"))
+                start = position + 2
+                position = buffer.find(self.SEPARATOR, start)
+        del buffer[:start]
+        self._scanOffset = max(len(buffer) - 1, 0)
+        return len(self._messages)
+
+    def has_messages(self):
+        return len(self._messages) > 0
+
+    def get_next_message(self):
+        if not self._messages:
+            return ""
+        return self._messages.popleft()
+
+    def get_messages(self):
+        messages = list(self._messages)
+        self._messages.clear()
+        return messages
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._scanOffset = 0
+        self._messages.clear()
+
+
+class Reactor:
+    """!
+    @brief Blocks until a registered socket becomes readable, a timeout elapses or another thread wakes it up.
+
+    Runs on top of an asyncio event loop. While the reactor waits, the loop runs, so tasks and
+    futures created on the loop ( see TeamspeakBot.query ) make progress in the meantime.
+
+    Any number of connections can share one reactor. dispatch hands readable sockets to the handler
+    they were registered with, so idle connections cost nothing per tick.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self._readable = []
+        self._handlers = {}
+
+    def register(self, sock, handler=None):
+        """!
+        @brief Watches a socket. Once it is readable, wait returns and dispatch calls the handler.
+
+        @param sock The socket
+        @param handler Called without arguments by dispatch. None when the owner reads the socket itself.
+        """
+        self._handlers[sock] = handler
+        self.loop.add_reader(sock, self._on_readable, sock)
+
+    def unregister(self, sock):
+        self._handlers.pop(sock, None)
+        try:
+            self.loop.remove_reader(sock)
+        except ValueError:
+            pass
+
+    def _on_readable(self, sock):
+        if sock not in self._readable:
+            self._readable.append(sock)
+        self.loop.stop()
+
+    def wakeup(self):
+        """!
+        @brief Interrupts a running or the next call to wait. Safe to call from any thread.
+        """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def wait(self, timeout=None):
+        """!
+        @brief Runs the event loop until a socket is readable, wakeup was called or the timeout elapsed.
+
+        @param timeout Maximum time to block in milliseconds. None blocks until a socket is readable.
+        @return List of the registered sockets which are readable. They are remembered until dispatch is called.
+        """
+        handle = None
+        if timeout is not None:
+            handle = self.loop.call_later(max(timeout, 0) / 1000, self.loop.stop)
+        self.loop.run_forever()
+        if handle is not None:
+            handle.cancel()
+        return list(self._readable)
+
+    def dispatch(self):
+        """!
+        @brief Calls the handlers of the sockets which became readable since the last dispatch.
+
+        @return None
+        """
+        readable = self._readable
+        self._readable = []
+        for sock in readable:
+            handler = self._handlers.get(sock)
+            if handler is not None:
+                handler()
+
+    def close(self):
+        self.loop.close()
 
 
 class TCPConnection:
-    def __init__(self, ip, port):
+    RECEIVE_SIZE = 65536
+
+    def __init__(self, ip, port, reactor=None, read_callback=None):
+        """!
+        @param read_callback Registered with the reactor, called by Reactor.dispatch when the socket is readable
+        """
         self._sock = None
         self.ip = ip
         self.port = port
-        self._messageBuffer = b""
+        self._framer = MessageFramer()
         self._connected = False
+        self._reactor = reactor
+        self._readCallback = read_callback
 
     def connect(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -17,9 +162,36 @@ class TCPConnection:
         self._sock.connect((self.ip, self.port))
         self._sock.settimeout(None)
         self._connected = True
+        if self._reactor is not None:
+            self._reactor.register(self._sock, self._readCallback)
+
+    async def connect_async(self, timeout=10):
+        """!
+        @brief Connects without blocking the event loop of the reactor.
+
+        Raises an OSError when the connection was refused and an asyncio.TimeoutError when it timed out.
+
+        @param timeout Seconds after which connecting is aborted
+        @return None
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(self._reactor.loop.sock_connect(sock, (self.ip, self.port)), timeout)
+        except BaseException:
+            sock.close()
+            raise
+        sock.setblocking(True)
+        self._sock = sock
+        self._connected = True
+        self._reactor.register(sock, self._readCallback)
 
     def disconnect(self):
         self._connected = False
+        if self._sock is None:
+            return
+        if self._reactor is not None and self._sock is not None:
+            self._reactor.unregister(self._sock)
         try:
             self._sock.shutdown(socket.SHUT_RDWR)
             self._sock.close()
@@ -27,29 +199,46 @@ class TCPConnection:
             pass
 
     def message_available(self):
-        self._handle_incoming_messages()
-        if b"\n\r" in self._messageBuffer:
-            return True
-        return False
+        if not self._framer.has_messages():
+            self._handle_incoming_messages()
+        return self._framer.has_messages()
 
     def _handle_incoming_messages(self):
-        readable, writeable, errored = select.select([self._sock], [], [], 0)
-        if len(readable) > 0:
-            self._messageBuffer += (self._sock.recv(255))
+        """!
+        @brief Drains everything the socket has to offer into the framer.
+
+        Raises a ConnectionResetError when the server closed the connection.
+        """
+        while True:
+            readable, writeable, errored = select.select([self._sock], [], [], 0)
+            if len(readable) == 0:
+                return
+            data = self._sock.recv(self.RECEIVE_SIZE)
+            if not data:
+                raise ConnectionResetError("Connection closed by the server")
+            self._framer.feed(data)
+            if len(data) < self.RECEIVE_SIZE:
+                return
 
     def get_next_message(self):
-        self._handle_incoming_messages()
         if not self.message_available():
             return ""
-        message = self._messageBuffer.partition(b"\n\r")
-        self._messageBuffer = message[2]
-        return message[0].decode("utf-8")
+        return self._framer.get_next_message()
+
+    def get_messages(self):
+        """!
+        @brief Returns all complete messages at once.
+
+        @return List of strings
+        """
+        self.message_available()
+        return self._framer.get_messages()
 
     def send_message(self, message):
         self._sock.send(message.encode("utf-8"))
 
     def clear_message_buffer(self):
-        self._messageBuffer = b""
+        self._framer.clear()
 
     def is_connected(self):
         return self._connected
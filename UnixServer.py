@@ -8,10 +8,12 @@ import threading
 
 
 class UnixServer(Thread):
-    def __init__(self, queue, socket_path):
+    def __init__(self, queue, socket_path, wakeup=None):
         super().__init__()
 
         self.queue = queue
+        # Called after an item was put into the queue, so the consumer does not need to poll it
+        self.wakeup = wakeup
 
         self.socket_path = socket_path
 
@@ -41,7 +43,7 @@ class UnixServer(Thread):
         self.server.listen(1)
 
         while not self.shutdown_flag.is_set():
-            readable, writable, errored = select.select([self.server], [], [], 0)
+            readable, writable, errored = select.select([self.server], [], [], 0.5)
             if len(readable) > 0:
                 self.client, _ = self.server.accept()
                 break
@@ -55,6 +57,8 @@ class UnixServer(Thread):
 
                 data = self.recv_exact(length)
                 self.queue.put_nowait([sender, data])
+                if self.wakeup is not None:
+                    self.wakeup()
 
         self.cleanup()
 
@@ -0,0 +1,95 @@
+# coding=utf-8
+"""!
+@brief Compares memory and field access time of the nested dict client layout and ClientRecord.
+
+Run from the repository root:
+
+    python -m bench.client_records
+"""
+import time
+import tracemalloc
+
+from Bot.DataManager import DataManager
+from Bot.Utility import normalize_message
+from bench import payloads
+
+CLIENT_COUNTS = (1000, 10000)
+ACCESS_ROUNDS = 20
+
+
+class LegacyClientList:
+    """!
+    @brief The client storage of DataManager before ClientRecord, three dictionaries per client.
+    """
+
+    def __init__(self):
+        self._clientList = {}
+
+    def add_client(self, clid, client_data):
+        self._clientList[int(clid)] = {
+            "teamspeak_data": client_data,
+            "custom_data": {},
+            "servergroups": {}
+        }
+
+    def get_clients(self):
+        return [client for client in self._clientList if
+                self._clientList[client]["teamspeak_data"]["client_type"] == '0']
+
+    def get_client_cldbid_by_clid(self, clid):
+        clid = int(clid)
+        if clid not in self._clientList:
+            return None
+        return int(self._clientList[clid]["teamspeak_data"]["client_database_id"])
+
+
+def fill_legacy(client_infos):
+    clients = LegacyClientList()
+    for client_info in client_infos:
+        clients.add_client(client_info["clid"], client_info)
+    return clients
+
+
+def fill_records(client_infos):
+    clients = DataManager(None)
+    for client_info in client_infos:
+        clients.add_client(client_info["clid"], client_info)
+    return clients
+
+
+def read_cldbids(clients):
+    for clid in clients.get_clients():
+        clients.get_client_cldbid_by_clid(clid)
+
+
+def client_infos(client_count):
+    return [normalize_message(payloads.clientinfo(clid, seed=clid))[0] for clid in range(1, client_count + 1)]
+
+
+def retained_memory(fill, client_count):
+    tracemalloc.start()
+    clients = fill(client_infos(client_count))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return clients, size / 1024
+
+
+def access_time(read, clients):
+    start = time.perf_counter()
+    for _ in range(ACCESS_ROUNDS):
+        read(clients)
+    return (time.perf_counter() - start) / ACCESS_ROUNDS * 1000
+
+
+def main():
+    print("{0:>8} {1:<8} {2:>14} {3:>14} {4:>16}".format("clients", "layout", "retained KiB", "bytes/client",
+                                                         "ms/all cldbids"))
+    for client_count in CLIENT_COUNTS:
+        for layout, fill in (("legacy", fill_legacy), ("record", fill_records)):
+            clients, size = retained_memory(fill, client_count)
+            print("{0:>8} {1:<8} {2:>14.0f} {3:>14.0f} {4:>16.3f}".format(
+                client_count, layout, size, size * 1024 / client_count, access_time(read_cldbids, clients)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# coding=utf-8
+"""!
+@brief Compares the single pass unescape with the former chain of str.replace calls.
+
+escape() is measured against a single pass candidate as well. It is kept on
+str.replace, because that candidate loses on every payload.
+
+Run from the repository root:
+
+    python -m bench.codec
+"""
+import re
+import timeit
+
+from Bot.Utility import escape, unescape
+from bench import payloads
+
+_ESCAPE_MAP = {"\\": "\\\\", "/": "\\/", " ": "\\s", "|": "\\p", "\a": "\\a", "\b": "\\b", "\f": "\\f",
+               "\n": "\\n", "\r": "\\r", "\t": "\\t", "\v": "\\v"}
+_ESCAPE_PATTERN = re.compile("[\\\\/ |\a\b\f\n\r\t\v]")
+
+
+def legacy_unescape(message):
+    message = message.replace("\\\\", "\\")
+    message = message.replace("\\/", "/")
+    message = message.replace("\\s", " ")
+    message = message.replace("\\p", "|")
+    message = message.replace("\\a", "\a")
+    message = message.replace("\\b", "\b")
+    message = message.replace("\\f", "\f")
+    message = message.replace("\\n", "\n")
+    message = message.replace("\\r", "\r")
+    message = message.replace("\\t", "\t")
+    message = message.replace("\\v", "\v")
+    return message
+
+
+def single_pass_escape(message):
+    return _ESCAPE_PATTERN.sub(lambda match: _ESCAPE_MAP[match.group()], message)
+
+
+def _values(answer):
+    return [token.partition("=")[2] for record in answer.split("|") for token in record.split(" ")]
+
+
+def check_correctness():
+    samples = ["", "plain", "a b|c/d\\e", "\\s", "\\\\s", "C:\\server\\new", "\a\b\f\n\r\t\v",
+               "Bob | AFK \\o/", "ends with \\"]
+    for sample in samples:
+        assert unescape(escape(sample)) == sample, sample
+        assert single_pass_escape(sample) == escape(sample), sample
+    # An escaped backslash followed by "s" must not turn into a space
+    assert unescape("C:\\\\server") == "C:\\server"
+    assert legacy_unescape("C:\\\\server") == "C: erver"
+    for value in _values(payloads.clientlist(200)):
+        assert escape(unescape(value)) == value, value
+
+
+def run(label, function, values, number):
+    seconds = timeit.timeit(lambda: [function(value) for value in values], number=number)
+    per_call = seconds / (number * len(values)) * 1e9
+    print("{0:<28} {1:>10.1f} ns/value {2:>12.0f} values/s".format(label, per_call, 1e9 / per_call))
+    return per_call
+
+
+def main():
+    check_correctness()
+
+    escaped_values = _values(payloads.clientlist(1000)) + _values(payloads.clientinfo())
+    raw_values = [unescape(value) for value in escaped_values]
+    messages = ["sendtextmessage targetmode=1 target=5 msg=" for _ in range(100)]
+    messages = [message + "Hello there | this is the bot, visit https://example.com/x \\o/" for message in messages]
+
+    print("{0} field values, {1} with escape sequences".format(
+        len(escaped_values), len([value for value in escaped_values if "\\" in value])))
+    print("{0:<28} {1:>10.2f}x".format("unescape speedup", run("unescape (str.replace)", legacy_unescape,
+                                                                  escaped_values, 20) /
+                                             run("unescape (single pass)", unescape, escaped_values, 20)))
+    for label, values, number in (("fields", raw_values, 20), ("chat", messages, 2000)):
+        print("{0:<28} {1:>10.2f}x".format("escape speedup",
+                                           run("escape {0} (str.replace)".format(label), escape, values, number) /
+                                           run("escape {0} (single pass)".format(label), single_pass_escape, values,
+                                               number)))
+
+
+if __name__ == "__main__":
+    main()
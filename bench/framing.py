@@ -0,0 +1,79 @@
+# coding=utf-8
+"""!
+@brief Feeds multi megabyte answer streams through the message framer.
+
+Compares the framer against the former bytes buffer, which was filled with 255 byte
+reads and partitioned once per message. The former buffer is quadratic in the size
+of a single answer, so it is skipped for the biggest streams.
+
+Run from the repository root:
+
+    python -m bench.framing
+"""
+import time
+
+from Network import MessageFramer, TCPConnection
+from bench import payloads
+
+LEGACY_LIMIT = 2 * 1024 * 1024
+
+
+def legacy_frame(chunks):
+    message_buffer = b""
+    messages = []
+    for chunk in chunks:
+        message_buffer += chunk
+        while b"\n\r" in message_buffer:
+            message = message_buffer.partition(b"\n\r")
+            message_buffer = message[2]
+            messages.append(message[0].decode("utf-8"))
+    return messages
+
+
+def frame(chunks):
+    framer = MessageFramer()
+    messages = []
+    for chunk in chunks:
+        framer.feed(chunk)
+        messages += framer.get_messages()
+    return messages
+
+
+def build_stream(client_count):
+    """!
+    @brief A clientlist answer followed by one notify line per client, like after a server restart
+    """
+    lines = [payloads.clientlist(client_count), "error id=0 msg=ok"] + payloads.notify_lines(client_count)
+    return "".join(line + "\n\r" for line in lines).encode("utf-8"), len(lines)
+
+
+def split(stream, size):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def measure(function, chunks):
+    start = time.perf_counter()
+    messages = function(chunks)
+    return time.perf_counter() - start, messages
+
+
+def main():
+    print("{0:>8} {1:>9} {2:<26} {3:>10} {4:>9} {5:>10}".format("clients", "MiB", "framing", "reads", "ms",
+                                                              "MiB/s"))
+    for client_count in (1000, 3000, 10000):
+        stream, message_count = build_stream(client_count)
+        mib = len(stream) / 1024 / 1024
+        runs = [("framer, {0} byte reads".format(TCPConnection.RECEIVE_SIZE), frame, TCPConnection.RECEIVE_SIZE),
+                ("framer, 255 byte reads", frame, 255)]
+        if len(stream) <= LEGACY_LIMIT:
+            runs.append(("old buffer, 255 byte reads", legacy_frame, 255))
+        for label, function, size in runs:
+            chunks = split(stream, size)
+            seconds, messages = measure(function, chunks)
+            assert len(messages) == message_count
+            print("{0:>8} {1:>9.2f} {2:<26} {3:>10} {4:>9.1f} {5:>10.1f}".format(
+                client_count, mib, label, len(chunks), seconds * 1000, mib / seconds))
+
+
+if __name__ == "__main__":
+    main()
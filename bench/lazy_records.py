@@ -0,0 +1,70 @@
+# coding=utf-8
+"""!
+@brief Compares CPU time and memory of eager and lazy records for a 1000 client clientlist.
+
+Run from the repository root:
+
+    python -m bench.lazy_records
+"""
+import time
+import tracemalloc
+
+from Bot.Utility import normalize_message, normalize_message_lazy
+from bench import payloads
+
+CLIENT_COUNT = 1000
+ROUNDS = 50
+
+
+def read_nothing(records):
+    return len(records)
+
+
+def read_two_fields(records):
+    for record in records:
+        record["connection_client_ip"]
+        record["client_database_id"]
+
+
+def read_one_record(records):
+    record = records[0]
+    record["clid"]
+    record["client_nickname"]
+
+
+def read_all_fields(records):
+    for record in records:
+        for key in record:
+            record[key]
+
+
+def cpu_time(parser, consumer, message):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        consumer(parser(message))
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def memory(parser, consumer, message):
+    tracemalloc.start()
+    records = parser(message)
+    consumer(records)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / 1024, peak / 1024
+
+
+def main():
+    message = payloads.clientlist(CLIENT_COUNT)
+    print("clientlist with {0} clients, {1:.0f} KiB".format(CLIENT_COUNT, len(message) / 1024))
+    print("{0:<18} {1:<6} {2:>10} {3:>14} {4:>14}".format("consumer", "mode", "ms/answer", "retained KiB",
+                                                          "peak KiB"))
+    for consumer in (read_nothing, read_one_record, read_two_fields, read_all_fields):
+        for mode, parser in (("eager", normalize_message), ("lazy", normalize_message_lazy)):
+            retained, peak = memory(parser, consumer, message)
+            print("{0:<18} {1:<6} {2:>10.2f} {3:>14.0f} {4:>14.0f}".format(
+                consumer.__name__, mode, cpu_time(parser, consumer, message), retained, peak))
+
+
+if __name__ == "__main__":
+    main()
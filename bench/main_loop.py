@@ -0,0 +1,103 @@
+# coding=utf-8
+"""!
+@brief Measures idle CPU usage and event latency of the main loop.
+
+Compares the former loop, which slept 10 ms between two process calls, with the
+reactor based loop, which blocks until the connection is readable. A local server
+thread plays the teamspeak server and sends timestamped lines.
+
+Run from the repository root:
+
+    python -m bench.main_loop
+"""
+import random
+import socket
+import statistics
+import threading
+import time
+
+from Network import Reactor, TCPConnection
+
+IDLE_SECONDS = 3
+EVENT_COUNT = 200
+
+
+def sleep_loop(connection, reactor, until, on_message):
+    while time.perf_counter() < until:
+        time.sleep(10 / 1000)
+        while connection.message_available():
+            on_message(connection.get_next_message())
+
+
+def reactor_loop(connection, reactor, until, on_message):
+    while True:
+        remaining = (until - time.perf_counter()) * 1000
+        if remaining <= 0:
+            return
+        reactor.wait(min(remaining, 1000))
+        while connection.message_available():
+            on_message(connection.get_next_message())
+
+
+def open_connection(reactor):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    connection = TCPConnection("127.0.0.1", server.getsockname()[1], reactor)
+    connection.connect()
+    peer, _ = server.accept()
+    server.close()
+    return connection, peer
+
+
+def measure_idle(loop):
+    reactor = Reactor()
+    connection, peer = open_connection(reactor)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    loop(connection, reactor, wall_start + IDLE_SECONDS, lambda message: None)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    connection.disconnect()
+    peer.close()
+    reactor.close()
+    return cpu / wall * 100
+
+
+def measure_latency(loop):
+    reactor = Reactor()
+    connection, peer = open_connection(reactor)
+    latencies = []
+
+    def send_events():
+        rng = random.Random(0)
+        for _ in range(EVENT_COUNT):
+            time.sleep(rng.uniform(0.001, 0.02))
+            peer.sendall("notifyclientmoved ctid=1 reasonid=0 clid={0!r}\n\r".format(time.perf_counter()).encode())
+
+    def on_message(message):
+        latencies.append((time.perf_counter() - float(message.rpartition("=")[2])) * 1000)
+
+    sender = threading.Thread(target=send_events)
+    sender.start()
+    loop(connection, reactor, time.perf_counter() + EVENT_COUNT * 0.02 + 1, on_message)
+    sender.join()
+    connection.disconnect()
+    peer.close()
+    reactor.close()
+    assert len(latencies) == EVENT_COUNT
+    latencies.sort()
+    return statistics.mean(latencies), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    print("{0:<22} {1:>10} {2:>14} {3:>14} {4:>14}".format("loop", "idle CPU", "latency mean", "latency p50",
+                                                             "latency p99"))
+    for label, loop in (("sleep 10 ms + poll", sleep_loop), ("reactor", reactor_loop)):
+        idle = measure_idle(loop)
+        mean, median, p99 = measure_latency(loop)
+        print("{0:<22} {1:>9.2f}% {2:>11.3f} ms {3:>11.3f} ms {4:>11.3f} ms".format(label, idle, mean, median, p99))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""!
+@brief Measures how many records per second normalize_message parses, compared to the former regex parser.
+
+Run from the repository root:
+
+    python -m bench.parser
+"""
+import re
+import time
+
+from Bot.Utility import normalize_message, unescape
+from bench import payloads
+
+
+def legacy_extract_args(message):
+    split = re.split(r"\s+", message)
+    value_map = {}
+    for i in split:
+        re_match = re.search(r"(^.*?)=(.*)", i)
+        if re_match:
+            key = re_match.group(1)
+            value = re_match.group(2)
+        else:
+            key = i
+            value = ""
+        value_map[key] = unescape(value)
+    return value_map
+
+
+def legacy_normalize_message(message):
+    ret = []
+    split = message.split("|")
+    for i in split:
+        ret.append(legacy_extract_args(i))
+    return ret
+
+
+def records_per_second(function, messages, minimum_seconds=0.5):
+    records = 0
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        for message in messages:
+            records += len(function(message))
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= minimum_seconds:
+            return records / elapsed
+
+
+def main():
+    print("{0:<12} {1:>8} {2:>14} {3:>14} {4:>9}".format("payload", "clients", "old rec/s", "new rec/s", "speedup"))
+    for client_count in (10, 500, 5000):
+        workloads = (
+            # One clientlist answer holding every client
+            ("clientlist", [payloads.clientlist(client_count)]),
+            # One clientinfo answer per client, as sent by the polling timer
+            ("clientinfo", [payloads.clientinfo(clid) for clid in range(1, client_count + 1)]),
+            # One notify line per client
+            ("notify*", payloads.notify_lines(client_count))
+        )
+        for label, messages in workloads:
+            for message in messages:
+                assert normalize_message(message) == legacy_normalize_message(message)
+            old = records_per_second(legacy_normalize_message, messages)
+            new = records_per_second(normalize_message, messages)
+            print("{0:<12} {1:>8} {2:>14.0f} {3:>14.0f} {4:>8.2f}x".format(label, client_count, old, new, new / old))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""!
+@brief Builds realistic server query payloads for the benchmarks in this package.
+
+All payloads are already escaped the way the teamspeak server sends them.
+"""
+import random
+
+from Bot.Utility import escape
+
+_NICKNAMES = ["Alice", "Bob | AFK", "Charlie (mobile)", "Dörte", "Eve/Work", "xX_Sn1p3r_Xx", "Frank \\o/",
+              "Gérard", "Heinz", "Iwan", "Jürgen the 2nd", "Kim", "Lars", "Mallory", "Nina"]
+
+_AWAY_MESSAGES = ["", "", "", "brb", "Gone for lunch | back at 14:00", "AFK\tzzz"]
+
+
+def _client_fields(clid, rng):
+    nickname = rng.choice(_NICKNAMES) + " " + str(clid)
+    return [
+        ("clid", str(clid)),
+        ("cid", str(rng.randint(1, 40))),
+        ("client_database_id", str(clid + 1000)),
+        ("client_nickname", nickname),
+        ("client_type", "0"),
+        ("client_unique_identifier", "CRhMp/NFyvdP1D8DDooQ{0:08d}=".format(clid)),
+        ("client_away", "0"),
+        ("client_away_message", rng.choice(_AWAY_MESSAGES)),
+        ("client_flag_talking", "0"),
+        ("client_input_muted", "0"),
+        ("client_output_muted", str(rng.randint(0, 1))),
+        ("client_input_hardware", "1"),
+        ("client_output_hardware", "1"),
+        ("client_talk_power", "75"),
+        ("client_is_talker", "0"),
+        ("client_is_priority_speaker", "0"),
+        ("client_is_recording", "0"),
+        ("client_is_channel_commander", "0"),
+        ("client_idle_time", str(rng.randint(0, 900000))),
+        ("client_created", "1500000000"),
+        ("client_lastconnected", "1508000000"),
+        ("client_servergroups", "6,7"),
+        ("client_channel_group_id", "8"),
+        ("client_version", "3.1.6 [Build: 1502873983]"),
+        ("client_platform", "Windows"),
+        ("client_country", "DE"),
+        ("connection_client_ip", "192.168.{0}.{1}".format(clid // 250, clid % 250))
+    ]
+
+
+def _format_record(fields):
+    return " ".join("{0}={1}".format(key, escape(value)) for key, value in fields)
+
+
+def clientlist(client_count, seed=0):
+    """!
+    @brief Returns a clientlist -uid -away -voice -times -groups -info -country -ip answer
+
+    @param client_count Number of records in the answer
+    @param seed Seed for the random generator
+    @return String
+    """
+    rng = random.Random(seed)
+    return "|".join(_format_record(_client_fields(clid, rng)) for clid in range(1, client_count + 1))
+
+
+def clientinfo(clid=5, seed=0):
+    """!
+    @brief Returns a single clientinfo answer with roughly the amount of fields a real server sends
+
+    @param clid The client id of the described client
+    @param seed Seed for the random generator
+    @return String
+    """
+    rng = random.Random(seed)
+    fields = _client_fields(clid, rng)
+    fields += [
+        ("client_description", "Just a regular | user with a very long description / bio"),
+        ("client_meta_data", ""),
+        ("client_default_channel", "/1"),
+        ("client_nickname_phonetic", ""),
+        ("client_flag_avatar", "6b8b9c27a1e2b7d5e0a6f1a2c3d4e5f6"),
+        ("client_badges", "Overwolf=0"),
+        ("connection_connected_time", str(rng.randint(0, 10000000)))
+    ]
+    for i in range(50):
+        fields.append(("connection_stat_{0}".format(i), str(rng.randint(0, 100000))))
+    return _format_record(fields)
+
+
+def notify_lines(count, seed=0):
+    """!
+    @brief Returns a list of mixed notify lines as received during normal operation
+
+    @param count Number of lines to generate
+    @param seed Seed for the random generator
+    @return List of strings
+    """
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        clid = rng.randint(1, 500)
+        kind = i % 4
+        if kind == 0:
+            lines.append("notifycliententerview cfid=0 ctid=1 reasonid=0 " +
+                         _format_record(_client_fields(clid, rng)))
+        elif kind == 1:
+            lines.append("notifyclientleftview cfid=1 ctid=0 reasonid=8 reasonmsg=leaving clid={0}".format(clid))
+        elif kind == 2:
+            lines.append("notifyclientmoved ctid={0} reasonid=0 clid={1}".format(rng.randint(1, 40), clid))
+        else:
+            lines.append("notifytextmessage targetmode=1 msg={0} target=1 invokerid={1} invokername={2} "
+                         "invokeruid=CRhMp\\/NFyvdP1D8DDooQIr8gAWI=".format(
+                             escape(".help me | please"), clid, escape(rng.choice(_NICKNAMES))))
+    return lines
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""!
+@brief Measures the cost of dispatching one event to the plugins, depending on how many plugins are loaded.
+
+The former dispatch looked up the hook on every plugin and called it, including the empty implementations
+inherited from PluginBase. PluginDispatcher only calls the plugins which implement the hook. In this benchmark
+two of the loaded plugins implement on_client_moved.
+
+Run from the repository root:
+
+    python -m bench.plugin_dispatch
+"""
+import asyncio
+import time
+
+from Bot.Utility import PluginDispatcher, Event
+
+PLUGIN_COUNTS = (5, 20, 50)
+IMPLEMENTING_PLUGINS = 2
+EVENTS = 50000
+ROUNDS = 3
+
+
+class StandInPluginBase:
+    """!
+    @brief Has the hooks of Bot.Plugins.Base.PluginBase, which can not be imported without a config.
+    """
+
+    def __init__(self):
+        self.order = 0
+
+    def on_initial_data(self, client_list, channel_list):
+        pass
+
+    def on_client_joined(self, event):
+        pass
+
+    def on_client_left(self, event):
+        pass
+
+    def on_client_moved(self, event):
+        pass
+
+    def on_private_text(self, event):
+        pass
+
+    def on_channel_text(self, event):
+        pass
+
+    def on_client_say(self, event):
+        pass
+
+    def on_connection_lost(self):
+        pass
+
+
+class IdlePlugin(StandInPluginBase):
+    pass
+
+
+class MovePlugin(StandInPluginBase):
+    def __init__(self):
+        super().__init__()
+        self.moves = 0
+
+    def on_client_moved(self, event):
+        self.moves += 1
+
+
+def create_plugins(plugin_count):
+    return [MovePlugin() for _ in range(IMPLEMENTING_PLUGINS)] + \
+           [IdlePlugin() for _ in range(plugin_count - IMPLEMENTING_PLUGINS)]
+
+
+def legacy_dispatch(plugins, method_name, *args):
+    for plugin in plugins:
+        result = getattr(plugin, method_name)(*args)
+        if asyncio.iscoroutine(result):
+            pass
+
+
+def table_dispatch(dispatcher, method_name, *args):
+    for handler in dispatcher.get_handlers(method_name):
+        result = handler(*args)
+        if asyncio.iscoroutine(result):
+            pass
+
+
+def measure(dispatch, target):
+    event = Event([{"clid": "5", "ctid": "2", "reasonid": "0"}])
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(EVENTS):
+            dispatch(target, "on_client_moved", event)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / EVENTS * 1000000
+
+
+def main():
+    print("{0:>8} {1:>18} {2:>18}".format("plugins", "getattr us/event", "table us/event"))
+    for plugin_count in PLUGIN_COUNTS:
+        plugins = create_plugins(plugin_count)
+        dispatcher = PluginDispatcher(StandInPluginBase)
+        for plugin in plugins:
+            dispatcher.register(plugin)
+        print("{0:>8} {1:>18.2f} {2:>18.2f}".format(plugin_count, measure(legacy_dispatch, plugins),
+                                                    measure(table_dispatch, dispatcher)))
+
+
+if __name__ == "__main__":
+    main()
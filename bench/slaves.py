@@ -0,0 +1,90 @@
+# coding=utf-8
+"""!
+@brief Measures the cost of one main loop tick depending on the number of idle channel slaves.
+
+The former tick called process on every slave, so every slave polled its socket with select and
+checked its own timers. Now the slaves share the reactor and the timer of the main bot, and the
+reactor only dispatches the connections which received data.
+
+Run from the repository root:
+
+    python -m bench.slaves
+"""
+import socket
+import time
+
+from Bot.Utility import Timer
+from Network import Reactor, TCPConnection
+
+SLAVE_COUNTS = (1, 10, 40, 100)
+TICKS = 2000
+
+
+def open_connections(reactor, count, read_callback):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(count)
+    connections = []
+    peers = []
+    for _ in range(count):
+        connection = TCPConnection("127.0.0.1", server.getsockname()[1], reactor, read_callback)
+        connection.connect()
+        connections.append(connection)
+        peers.append(server.accept()[0])
+    server.close()
+    return connections, peers
+
+
+def start_slave_timers(timer):
+    # the heartbeat and the query timeout check every bot starts
+    timer.start_timer(lambda: None, 60000, False)
+    timer.start_timer(lambda: None, 1000, False)
+
+
+def polling_tick(reactor, connections, timers):
+    reactor.wait(0)
+    for connection, timer in zip(connections, timers):
+        connection.message_available()
+        timer.check_timers()
+
+
+def dispatching_tick(reactor, connections, timers):
+    reactor.wait(0)
+    reactor.dispatch()
+    timers[0].check_timers()
+
+
+def measure(tick, slave_count):
+    reactor = Reactor()
+    connections, peers = open_connections(reactor, slave_count, lambda: None)
+    if tick is polling_tick:
+        timers = [Timer() for _ in connections]
+        for timer in timers:
+            start_slave_timers(timer)
+    else:
+        timers = [Timer()]
+        for _ in connections:
+            start_slave_timers(timers[0])
+
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        tick(reactor, connections, timers)
+    elapsed = time.perf_counter() - start
+
+    for connection in connections:
+        connection.disconnect()
+    for peer in peers:
+        peer.close()
+    reactor.close()
+    return elapsed / TICKS * 1000000
+
+
+def main():
+    print("{0:>8} {1:>16} {2:>16}".format("slaves", "poll us/tick", "dispatch us/tick"))
+    for slave_count in SLAVE_COUNTS:
+        print("{0:>8} {1:>16.1f} {2:>16.1f}".format(slave_count, measure(polling_tick, slave_count),
+                                                    measure(dispatching_tick, slave_count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""!
+@brief Compares the join/leave throughput of the storage backends, with and without write behind.
+
+Every join writes an OnlineClients row and reads the ClientSettings of the client, every leave deletes the row.
+MySQL is only measured when pymysql is installed and the connection is configured through the environment:
+
+    BENCH_MYSQL_HOST, BENCH_MYSQL_PORT, BENCH_MYSQL_USER, BENCH_MYSQL_PASSWORD, BENCH_MYSQL_DB
+
+Run from the repository root:
+
+    python -m bench.storage
+"""
+import os
+import tempfile
+import time
+
+from Bot.SqliteManager import SqliteManager
+
+CLIENT_COUNT = 2000
+# Number of clients which are online at the same time, the rest joins and leaves again
+ONLINE_COUNT = 200
+FLUSH_EVERY = 50
+
+
+def join_leave(storage_manager, write_behind):
+    storage_manager.clear_online_clients()
+    storage_manager.flush(False)
+    start = time.perf_counter()
+    for clid in range(CLIENT_COUNT):
+        storage_manager.add_online_client(clid, clid + 1000, "Client {0}".format(clid), "10.0.0.1", 0)
+        storage_manager.get_client_values(clid + 1000)
+        storage_manager.set_client_accesslevel(clid, 1)
+        if clid >= ONLINE_COUNT:
+            storage_manager.remove_online_client(clid - ONLINE_COUNT)
+        if write_behind and clid % FLUSH_EVERY == 0:
+            # stands in for the flush timer, which runs every flush_interval
+            storage_manager.flush(False)
+    storage_manager.flush(False)
+    return CLIENT_COUNT / (time.perf_counter() - start)
+
+
+def create_sqlite(path):
+    def factory():
+        storage_manager = SqliteManager()
+        storage_manager.connect_to_db(path)
+        return storage_manager
+    return factory
+
+
+def create_mysql():
+    try:
+        from Bot.MysqlManager import MysqlManager
+    except ImportError:
+        return None
+    if "BENCH_MYSQL_HOST" not in os.environ:
+        return None
+
+    def factory():
+        storage_manager = MysqlManager()
+        storage_manager.connect_to_db(os.environ["BENCH_MYSQL_HOST"],
+                                      int(os.environ.get("BENCH_MYSQL_PORT", 3306)),
+                                      os.environ.get("BENCH_MYSQL_USER", "ts3bot"),
+                                      os.environ.get("BENCH_MYSQL_PASSWORD", ""),
+                                      os.environ.get("BENCH_MYSQL_DB", "ts3bot"))
+        return storage_manager
+    return factory
+
+
+def main():
+    directory = tempfile.TemporaryDirectory()
+    backends = [("sqlite", create_sqlite(os.path.join(directory.name, "bench.sqlite"))), ("mysql", create_mysql())]
+
+    print("{0} joins and leaves, {1} clients online".format(CLIENT_COUNT, ONLINE_COUNT))
+    print("{0:<8} {1:<14} {2:>14}".format("backend", "mode", "joins/s"))
+    for name, factory in backends:
+        if factory is None:
+            print("{0:<8} skipped, pymysql or BENCH_MYSQL_HOST missing".format(name))
+            continue
+        for mode in ("direct", "write behind", "wb + cache"):
+            storage_manager = factory()
+            if mode != "direct":
+                storage_manager.enable_write_behind(FLUSH_EVERY * 10)
+            if mode == "wb + cache":
+                storage_manager.enable_cache()
+            print("{0:<8} {1:<14} {2:>14.0f}".format(name, mode, join_leave(storage_manager, mode != "direct")))
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""!
+@brief Measures the cost of Timer.check_timers and Timer.start_timer/remove_timer with many running timers.
+
+The former timer copied its dictionary on every check and compared every timer
+against the wall clock, so it is included for comparison.
+
+Also checks that removing many timers from inside a timer callback, e.g when the main bot kills
+slaves sharing its timer, does not lose the repeating timers which fired in the same check.
+
+Run from the repository root:
+
+    python -m bench.timers
+"""
+import time
+import timeit
+
+from Bot.Utility import Timer, time_since_epoch
+
+CANCEL_STORM_TIMERS = 100
+
+
+class LegacyTimer:
+    def __init__(self):
+        self._timer_list = {}
+        self._timer_counter = 0
+
+    def start_timer(self, callback, interval, is_single_shot=False, *args):
+        self._timer_counter += 1
+        self._timer_list[self._timer_counter] = [callback, time_since_epoch()+interval, interval, is_single_shot, args]
+        return self._timer_counter
+
+    def remove_timer(self, timer_id):
+        if timer_id in self._timer_list:
+            self._timer_list.pop(timer_id)
+            return True
+        return False
+
+    def check_timers(self):
+        for i in dict(self._timer_list):
+            timer = self._timer_list[i]
+            if time_since_epoch() > timer[1]:
+                timer[0](*timer[4])
+                timer[1] = time_since_epoch() + timer[2]
+                if timer[3]:
+                    self._timer_list.pop(i)
+
+
+def check_cancel_storm():
+    """!
+    @brief A single shot callback removes enough timers to trigger the compaction of the heap, while a
+    repeating timer which was due in the same check waits to be rescheduled.
+
+    @return Number of times the repeating timer fired within 5 of its intervals
+    """
+    timer = Timer()
+    timer_ids = [timer.start_timer(lambda: None, 60000) for _ in range(CANCEL_STORM_TIMERS)]
+    fired = []
+    periodic_id = timer.start_timer(lambda: fired.append(1), 1)
+
+    def remove_all():
+        for timer_id in timer_ids:
+            timer.remove_timer(timer_id)
+    timer.start_timer(remove_all, 1, True)
+
+    end = time.monotonic() + 0.005
+    while time.monotonic() < end:
+        timer.check_timers()
+        time.sleep(0.001)
+    assert timer.remove_timer(periodic_id), "the repeating timer vanished from the timer list"
+    assert len(fired) > 1, "the repeating timer was lost by the compaction, it fired {0} time(s)".format(len(fired))
+    return len(fired)
+
+
+def main():
+    print("cancel storm inside a callback: repeating timer fired {0} times".format(check_cancel_storm()))
+    print("{0:>8} {1:<8} {2:>22} {3:>26}".format("timers", "timer", "check, none due (us)", "start + remove (us)"))
+    for timer_count in (10, 100, 1000, 10000):
+        for label, timer_class in (("old", LegacyTimer), ("heap", Timer)):
+            timer = timer_class()
+            for _ in range(timer_count):
+                timer.start_timer(lambda: None, 60000)
+            number = max(100000 // timer_count, 10)
+            check = timeit.timeit(timer.check_timers, number=number) / number * 1e6
+            churn = timeit.timeit(lambda: timer.remove_timer(timer.start_timer(lambda: None, 30000)),
+                                  number=10000) / 10000 * 1e6
+            print("{0:>8} {1:<8} {2:>22.3f} {3:>26.3f}".format(timer_count, label, check, churn))
+
+
+if __name__ == "__main__":
+    main()